@@ -57,6 +57,13 @@ filename = filename
 climafile = climatological_metric_file
 forecastfile = ensemble_metric_file
 weightfile = forecast_metric_file
+outputfile = ensemble_output_file
+plot_dpi = plot_dpi
+plot_format = plot_format
+bootstrap_samples = bootstrap_samples
+bootstrap_level = bootstrap_level
+results_db = results_db
+glam_year_keys = glam_year_keys
 datastartyear = datastartyear
 dataendyear = dataendyear
 climastartyear = climstartyear
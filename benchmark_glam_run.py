@@ -0,0 +1,140 @@
+# =======================================================================##
+# End to end benchmark of TAMSAT-ALERT-GLAM (glam_run)
+# =======================================================================##
+# This script run calc_cropyield_wrapper.glam_run with the GLAM stand-in
+# (glam_standin.py) on a synthetic forcing file in a separate working
+# folder and report the wall time of each stage of the run and of the
+# GLAM run of each ensemble member. Every configuration (number of
+# parallel workers) is run with an empty GLAM results cache first and
+# then again with the cache filled by the first run.
+# Example:
+#   python benchmark_glam_run.py --processes 0,2,4 --runtime 0.5
+# (0 = ensemble members run one after another in the working folder)
+# =======================================================================##
+import argparse
+import os
+import shutil
+import stat
+import sys
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+CONFIG_PATH = './config/bench/'
+WTH_PATH = CONFIG_PATH + 'ascii_input/wth/'
+
+
+def make_forcing(filename, datastartyear, dataendyear):
+    """
+    This function write a synthetic daily forcing file in the JULES forcing format
+    (leap days included, deterministic values).
+    :param filename: the name of the forcing file
+    :param datastartyear: the year the data set start
+    :param dataendyear: the year the data set end
+    :return None
+    """
+    ndays = int((np.datetime64('%s-01-01' % (dataendyear + 1)) - np.datetime64('%s-01-01' % datastartyear)) /
+                np.timedelta64(1, 'D'))
+    rng = np.random.RandomState(0)
+    season = np.sin(2 * np.pi * np.arange(ndays) / 365.25)
+    data = np.zeros((ndays, 10))
+    data[:, 0] = 200 + 30 * season + rng.rand(ndays) * 10  # short wave radiation (W m-2)
+    data[:, 2] = np.where(rng.rand(ndays) < 0.3, rng.rand(ndays) * 0.0004, 0.)  # rainfall (kg m-2 s-1)
+    data[:, 4] = 298 + 3 * season + rng.randn(ndays)  # mean temperature (K)
+    data[:, 9] = 12 + rng.rand(ndays) * 4  # diurnal temperature range (K)
+    np.savetxt(filename, data, fmt='%.6g')
+    return None
+
+
+def setup(workdir, datastartyear, dataendyear, climstartyear):
+    """
+    This function prepare the working folder of the benchmark: the forcing file,
+    the config folder and the GLAM stand-in executable.
+    """
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    forcing = os.path.join(workdir, 'bench_forcing.txt')
+    if not os.path.isfile(forcing):
+        make_forcing(forcing, datastartyear, dataendyear)
+
+    if not os.path.isdir(os.path.join(workdir, WTH_PATH)):
+        os.makedirs(os.path.join(workdir, WTH_PATH))
+    with open(os.path.join(workdir, CONFIG_PATH, 'bench.glam'), 'w') as f:
+        f.write('ISYR %s\nIEYR %s\n' % (climstartyear, dataendyear))
+
+    standin = os.path.join(workdir, 'glam')
+    shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glam_standin.py'), standin)
+    os.chmod(standin, os.stat(standin).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return None
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='End to end benchmark of glam_run with the GLAM stand-in.')
+    parser.add_argument('--workdir', default='./benchmark', help='working folder of the benchmark')
+    parser.add_argument('--datastartyear', type=int, default=1970)
+    parser.add_argument('--dataendyear', type=int, default=2011)
+    parser.add_argument('--climstartyear', type=int, default=1980)
+    parser.add_argument('--climendyear', type=int, default=2009)
+    parser.add_argument('--processes', default='0',
+                        help='comma separated numbers of parallel workers (0 = sequential)')
+    parser.add_argument('--runtime', type=float, default=0.,
+                        help='artificial run time (seconds) of each GLAM stand-in run')
+    parser.add_argument('--repeat', type=int, default=2,
+                        help='runs of each configuration, the first one with an empty results cache')
+    parser.add_argument('--forecast-year-only', action='store_true',
+                        help='the members simulate only the forecast year')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='only calculate and save the risk (no plot)')
+    options = parser.parse_args(args)
+
+    setup(options.workdir, options.datastartyear, options.dataendyear, options.climstartyear)
+    os.chdir(options.workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ['GLAM_STANDIN_RUNTIME'] = str(options.runtime)
+
+    import calc_cropyield_wrapper as wrapper
+    import glam_exec
+    import glam_cache
+
+    # the settings of ReadVar.py replaced for the benchmark
+    forecastyear = options.dataendyear
+    settings = {'filename': 'bench_forcing.txt', 'leapremoved': 0, 'leapinit': 1,
+                'datastartyear': options.datastartyear, 'dataendyear': options.dataendyear,
+                'climstartyear': options.climstartyear, 'climendyear': options.climendyear,
+                'climastartyear': options.climstartyear, 'climaendyear': options.climendyear,
+                'forecastyear': forecastyear, 'periodstart_year': forecastyear,
+                'periodend_year': forecastyear + 1, 'wf_year': forecastyear,
+                'wth_path': WTH_PATH, 'glam_command': './glam ' + CONFIG_PATH + 'bench.glam SET 0.19'}
+    for name, value in settings.items():
+        setattr(wrapper, name, value)
+
+    results = []
+    for processes in [int(p) for p in options.processes.split(',')]:
+        for run in range(0, options.repeat):
+            if run == 0 and os.path.isdir(glam_cache.CACHE_PATH):
+                shutil.rmtree(glam_cache.CACHE_PATH)
+            glam_cache.stats['hits'] = glam_cache.stats['misses'] = 0
+            wrapper.glam_run(in_memory=True, processes=processes or None,
+                             forecast_year_only=options.forecast_year_only, plots=not options.no_plots)
+            label = '%s %s' % ('sequential' if processes == 0 else '%s workers' % processes,
+                               'cold' if run == 0 else 'warm')
+            results.append((label, dict(wrapper.stage_times), dict(glam_exec.member_times)))
+
+    # report
+    stages = list(wrapper.stage_times.keys())
+    print '\n%-18s' % 'stage (s)' + ''.join('%20s' % label for label, times, members in results)
+    for stage in stages + ['total']:
+        print '%-18s' % stage + ''.join('%20.3f' % (sum(times.values()) if stage == 'total' else times.get(stage, 0.))
+                                        for label, times, members in results)
+    print '\n%-18s' % 'member runs (s)' + ''.join('%20s' % label for label, times, members in results)
+    for name, func in [('count', len), ('mean', np.mean), ('min', np.min), ('max', np.max), ('sum', np.sum)]:
+        print '%-18s' % name + ''.join('%20.3f' % (func(list(members.values())) if members else 0.)
+                                       for label, times, members in results)
+    # the sum of the member run times over the yield forecast stage time
+    print '%-18s' % 'parallelism' + ''.join('%20.2f' % (np.sum(list(members.values())) / times['yield forecast'])
+                                           for label, times, members in results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
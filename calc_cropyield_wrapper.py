@@ -9,6 +9,8 @@
 # 1. prepare the ensemble files for the forecast year
 # 2. prepare the ensemble files in GLAM data format.
 # 3. run the GLAM command for yield simulation and risk calculation.
+# The function glam_hindcast() run the forecast for many years and
+# forecast dates and calculate the skill scores of the risk.
 # ======================================================================##
 
 from prepare_driving import *
@@ -20,33 +22,124 @@ import hydraulic_params
 import glam_data_prep
 import cropyield_est
 import calcrisk
+import plot_render
+import results_store
+import incremental
+import glam_exec
+import warning
+from collections import OrderedDict
+from wthfile import wth_filename
 from ReadVar import *
 
+# wall time (seconds) of each stage of the last glam_run
+stage_times = OrderedDict()
 
-def glam_run():
+
+def stage_time(stage, starttime):
+    """
+    This function record the wall time of a stage of glam_run.
+    :param stage: the name of the stage
+    :param starttime: the time the stage started
+    :return the current time (start of the next stage)
+    """
+    now = dt.datetime.now()
+    stage_times[stage] = (now - starttime).total_seconds()
+    return now
+
+
+def glam_run(in_memory=False, incremental_update=False, processes=None, forecast_year_only=False, plots=True):
     """
     This is a wrapper function that combine the preparation of GLAM weather driving
     data preparation and running TAMSAT-ALERT to calculate risk.
-    :return: None
+    :param in_memory: if True the forcing data, the ensemble members and their GLAM
+                      weather data are passed between the steps in memory and only the
+                      .wth files read by GLAM are written to disk (nothing in ./ensemrun).
+    :param incremental_update: if True (implies in_memory) the days appended to the forcing
+                               file since the previous run are detected and only the weather
+                               files which changed are regenerated. The weather files are kept
+                               for the next run, so the ensemble members whose GLAM inputs did
+                               not change are served from the GLAM results cache.
+    :param processes: if given, the GLAM runs of the ensemble members are executed in parallel
+                      on this number of workers (each member in its own scratch directory).
+    :param forecast_year_only: if True the ensemble members simulate only the forecast year and
+                               the climatology is simulated once (see cropyield_est.yieldforecast).
+                               The GLAM config file must have the simulated years (glam_year_keys
+                               of config.py).
+    :param plots: if False the risk is only calculated and saved in the text files (no plot).
+                  The plots are rendered on the workers when processes is given, with the
+                  resolution and format plot_dpi and plot_format of config.py.
+                  The confidence bounds of the risk are calculated when bootstrap_samples
+                  of config.py is not 0. The risk is added to the results store results_db
+                  of config.py (see results_store) unless it is None.
+                  The forcing file and wth_path are checked to cover the run before any data
+                  preparation (see warning.check_forcing).
+    :return: the risk result (see calcrisk.risk_forecast), the wall time of each
+             stage is kept in stage_times
     """
     starttime = dt.datetime.now()
+    stage_times.clear()
+    steptime = starttime
+    if incremental_update:
+        in_memory = True
+
+    # 0. check the forcing data cover the run before any data preparation
+    warning.check_forcing(filename, leapremoved, datastartyear, dataendyear, climstartyear, climendyear,
+                          forecastyear, forecastmonth, forecastday, periodend_year, periodend_month,
+                          periodend_day, wth_path)
+    glam_exec.config_year_keys = tuple(glam_year_keys)
+    if forecast_year_only:
+        glam_exec.check_config_years(glam_command)
+    steptime = stage_time('preflight', steptime)
 
     # 1. prepare the ensemble files for the forecast year
     outdata = prepare_historical_run(filename, leapremoved, datastartyear)
-    output = prepare_ensemble_runs(forecastyear, forecastmonth, forecastday,
-                                   periodstart_year, periodstart_month, periodstart_day,
-                                   periodend_year, periodend_month, periodend_day, datastartyear,
-                                   climstartyear, climendyear, leapinit, outdata[1], outdata[0])
+    if incremental_update:
+        statefile = incremental.state_filename(sta_name)
+        state = incremental.load_state(statefile)
+        signature = [filename, leapremoved, datastartyear, dataendyear, climstartyear, climendyear,
+                     forecastyear, sta_name, lat, lon, wth_path, glam_command, soiltex, forecast_year_only]
+        firstyear = incremental.first_changed_year(state, signature, outdata[1], datastartyear, leapremoved)
+        # the forecast year weather is always regenerated
+        if firstyear is None:
+            startyear = datastartyear
+        else:
+            startyear = min(firstyear, forecastyear)
+        for year in range(datastartyear, startyear):
+            if not os.path.exists(wth_filename(wth_path, sta_name, year)):
+                startyear = datastartyear
+                break
+    steptime = stage_time('forcing', steptime)
+
+    if in_memory:
+        # the members share the history before the forecast date: the views of the
+        # forcing data are only converted to the first year (365 days) GLAM needs
+        ensemble = ensemble_views(forecastyear, forecastmonth, forecastday,
+                                  periodstart_year, periodstart_month, periodstart_day,
+                                  periodend_year, periodend_month, periodend_day, datastartyear,
+                                  climstartyear, climendyear, leapinit, outdata[1], outdata[0])[:2]
+    else:
+        output = prepare_ensemble_runs(forecastyear, forecastmonth, forecastday,
+                                       periodstart_year, periodstart_month, periodstart_day,
+                                       periodend_year, periodend_month, periodend_day, datastartyear,
+                                       climstartyear, climendyear, leapinit, outdata[1], outdata[0])
+    steptime = stage_time('ensemble', steptime)
 
     # 2. prepare the ensemble files in GLAM data format.
     # The files are for the forecast year based on all the
     # climatological weather data considered after the forecast date.
-    climayears = np.arange(climstartyear, climendyear+1)
-    for i in range(0, len(climayears)):
-        ensemrun_path = './ensemrun/'
-        ense_filename = ensemrun_path+"ensrun_"+str(climayears[i])+".txt"
-        ensem_glam_data_prep.prepdata(ense_filename, sta_name, lat, lon, climastartyear,
-                                      climaendyear, forecastyear, ensemrun_path)
+    if in_memory:
+        # the members whose GLAM inputs did not change since the previous run are
+        # served from the GLAM results cache (keyed by all their inputs)
+        ensemble_weather = ensem_glam_data_prep.ensemble_weather(ensemble, forecastyear)
+    else:
+        ensemble_weather = None
+        climayears = np.arange(climstartyear, climendyear+1)
+        for i in range(0, len(climayears)):
+            ensemrun_path = './ensemrun/'
+            ense_filename = ensemrun_path+"ensrun_"+str(climayears[i])+".txt"
+            ensem_glam_data_prep.prepdata(ense_filename, sta_name, lat, lon, climastartyear,
+                                          climaendyear, forecastyear, ensemrun_path)
+    steptime = stage_time('ensemble weather', steptime)
 
     # 3. run the GLAM command for yield simulation and risk calculation
 
@@ -54,31 +147,136 @@ def glam_run():
     # imported with the modules above !!!
 
     # 3.2 Prepare the .wth weather files for GLAM
-    glam_data_prep.prepdata(filename, sta_name, lat, lon, datastartyear, dataendyear, wth_path)
+    if incremental_update:
+        glam_data_prep.daily_data(outdata[1], sta_name, lat, lon, datastartyear, dataendyear, wth_path,
+                                  startyear=startyear)
+        # the copy of the forecast year weather is refreshed by the yield forecast
+        if os.path.exists(wth_filename(wth_path, 'origi_' + sta_name, forecastyear)):
+            os.remove(wth_filename(wth_path, 'origi_' + sta_name, forecastyear))
+    elif in_memory:
+        glam_data_prep.daily_data(outdata[1], sta_name, lat, lon, datastartyear, dataendyear, wth_path)
+    else:
+        glam_data_prep.prepdata(filename, sta_name, lat, lon, datastartyear, dataendyear, wth_path)
+    steptime = stage_time('weather files', steptime)
 
     # 3.3 Soil properties vales are saved (soils.txt)
     hydraulic_params.pedoclass(soiltex, wth_path)
+    steptime = stage_time('soils', steptime)
 
     # 3.4 Run the yield forecast for a single date and plot
     cropyield_est.yieldforecast(datastartyear, dataendyear, climastartyear, climaendyear,
                                 forecastyear, forecastmonth, forecastday, wth_path, sta_name,
-                                lat, lon, glam_command, weights, climafile, forecastfile)
+                                lat, lon, glam_command, weights, climafile, forecastfile,
+                                ensemble_weather=ensemble_weather,
+                                processes=processes, outputfile=outputfile,
+                                forecast_year_only=forecast_year_only)
+    steptime = stage_time('yield forecast', steptime)
+
+    # 3.5 run TAMSAT-ALERT risk (result will be text files and plots)
+    risk = calcrisk.risk_forecast(climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
+                                  stat, sta_name, wth_path, weights, weight_var, wf_year, wf_month,
+                                  wf_day, w_leadtime, climafile, forecastfile,
+                                  nboot=bootstrap_samples, level=bootstrap_level)
+    calcrisk.save_risk(risk, weightfile=weightfile)
+    # keep the history of the forecasts (see results_store)
+    if results_db:
+        results_store.append(risk, climastartyear, climaendyear, weights, results_db)
+    steptime = stage_time('risk', steptime)
+    if plots:
+        # the risk and weather plots rendered together (on the workers if processes is given)
+        summary = calcrisk.climate_summary(climastartyear, climaendyear, forecastyear, sta_name, wth_path, weights)
+        plot_render.render(plot_render.risk_jobs(risk, climastartyear, climaendyear, dpi=plot_dpi, fmt=plot_format) +
+                           plot_render.climate_jobs(summary, dpi=plot_dpi, fmt=plot_format), processes)
+        steptime = stage_time('plots', steptime)
+
+    if incremental_update:
+        # keep the weather data and record the state for the next run
+        incremental.record_forcing(state, signature, outdata[1])
+        incremental.save_state(statefile, state)
+    else:
+        # remove all the weather data in the wth folder (This cleans folder for next run)
+        files = glob.glob(wth_path + '/*')
+        for f in files:
+            os.remove(f)
+    stage_time('cleanup', steptime)
+
+    endtime = dt.datetime.now()
+    time_diff = endtime - starttime
+    print "Time it took to complete the task -> %s" % time_diff
 
-    # 3.5 run TAMSAT-ALERT risk (result will be plots)
-    calcrisk.risk_prob_plot(climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
-                            stat, sta_name, wth_path, weights, weight_var, wf_year, wf_month,
-                            wf_day, w_leadtime, climafile, forecastfile, weightfile)
+    return risk
+
+
+def glam_hindcast(hindyears, initdates, processes=None, use_cache=True, forecast_year_only=False, plots=False):
+    """
+    This is a wrapper function that run the hindcast of TAMSAT-ALERT-GLAM for many
+    forecast years and forecast dates in one job with the settings of ReadVar.py.
+    The weather files and the soils file are prepared once for all the forecasts.
+    :param hindyears: the forecast years of the hindcast (e.g. range(1990, 2010))
+    :param initdates: the forecast dates of each year as a list of (month, day) (e.g. [(5, 1), (6, 1)])
+    :param processes: if given, the GLAM runs of the ensemble members are executed in parallel
+                      on this number of workers (each member in its own scratch directory).
+    :param use_cache: if True the GLAM runs are served from the GLAM results cache when possible
+    :param forecast_year_only: if True the ensemble members simulate only the forecast year
+                               (the GLAM config file must have the glam_year_keys of config.py)
+    :param plots: if True the risk plots of all the forecasts are rendered in ./plot_output/hindcast/
+                  (on the workers when processes is given)
+    :return: the hindcast result (see cropyield_est.hindcast), the risk of all the forecasts
+             is also added to the results store results_db of config.py unless it is None
+    """
+    starttime = dt.datetime.now()
+
+    # 0. check the forcing data cover all the forecasts before any data preparation
+    for year in hindyears:
+        for month, day in initdates:
+            warning.check_forcing(filename, leapremoved, datastartyear, dataendyear, climastartyear, climaendyear,
+                                  year, month, day, year + 1, 12, 31, wth_path)
+    glam_exec.config_year_keys = tuple(glam_year_keys)
+    if forecast_year_only:
+        glam_exec.check_config_years(glam_command)
+
+    # 1. the forcing data (with and without the leap days) kept in memory
+    outdata = prepare_historical_run(filename, leapremoved, datastartyear)
+
+    # 2. the .wth weather files and the soil properties shared by all the forecasts
+    glam_data_prep.daily_data(outdata[1], sta_name, lat, lon, datastartyear, dataendyear, wth_path)
+    hydraulic_params.pedoclass(soiltex, wth_path)
+
+    # 3. run the forecasts and calculate the skill scores
+    result = cropyield_est.hindcast(datastartyear, dataendyear, climastartyear, climaendyear, hindyears,
+                                    initdates, wth_path, sta_name, lat, lon, glam_command, weights, stat,
+                                    weight_var, wf_year, wf_month, wf_day, w_leadtime, leapinit,
+                                    outdata[1], outdata[0], processes=processes, use_cache=use_cache,
+                                    forecast_year_only=forecast_year_only)
 
     # remove all the weather data in the wth folder (This cleans folder for next run)
     files = glob.glob(wth_path + '/*')
     for f in files:
         os.remove(f)
 
+    # 4. the risk of all the forecasts kept in the results store and plotted
+    if plots or results_db:
+        risks = []
+        for c in range(0, len(result['year'])):
+            risk = calcrisk.risk_assessment(result['climametric'][c], result['forecametric'][c],
+                                            result['wmetric'][c], weights, stat)
+            risk.update({'sta_name': sta_name, 'forecast_date': dt.date(result['year'][c], result['month'][c],
+                                                                        result['day'][c]).strftime('%d-%b-%Y')})
+            risks.append(risk)
+        if results_db:
+            results_store.append(risks, climastartyear, climaendyear, weights, results_db)
+        if plots:
+            jobs = []
+            for risk in risks:
+                jobs += plot_render.risk_jobs(risk, climastartyear, climaendyear, path='./plot_output/hindcast/',
+                                              dpi=plot_dpi, fmt=plot_format)
+            plot_render.render(jobs, processes)
+
     endtime = dt.datetime.now()
     time_diff = endtime - starttime
-    print "Time it took to complete the task -> %s" % time_diff
+    print "Time it took to complete the hindcast -> %s" % time_diff
 
-    return None
+    return result
 
 # ============================================================================#
 
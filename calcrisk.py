@@ -6,22 +6,26 @@
 import numpy as np
 import datetime as dt
 import os
-import matplotlib.pyplot as plt
 import scipy.stats as sps
-from statsmodels.distributions.empirical_distribution import ECDF
-import seaborn as sns
 import weighting
+import plot_render
+import clima_store
+from wthfile import wth_filename, read_wth
+
+# index of the 20, 40, 60 and 80th percentiles in the normal risk curve
+NORMAL_CATEGORY_INDEX = [19, 39, 59, 79]
 # ====================================================================#
 # calculate the risk probability and present results
 # ====================================================================#
 
 
-def risk_prob_plot(climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
-                   stat, sta_name, wth_path, weights, weight_var, wf_year, wf_month, wf_day,
-                   w_leadtime, climafile, forecastfile, weightfile):
+def risk_forecast(climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
+                  stat, sta_name, wth_path, weights, weight_var, wf_year, wf_month, wf_day,
+                  w_leadtime, climafile, forecastfile, nboot=0, level=0.9):
     """
-    This function plot the probability estimates for poor yield for a single date
-    forecast given in the configuration file.
+    This function calculate the risk of the single date forecast given in the
+    configuration file. It only reads the inputs (no output file or plot), the
+    result can be saved with save_risk and plotted with plot_risk.
 
     :param climastartyear: the year climatology value start.
     :param climaendyear: the year climatology value end.
@@ -42,17 +46,11 @@ def risk_prob_plot(climastartyear, climaendyear, forecastyear, forecastmonth, fo
     :param w_leadtime: the number of days from the wf_day the weighting metric will be assumed
     :param climafile: file contain climatological values of the metric under investigation
     :param forecastfile: file contain ensembles forecast values of the metric under investigation
-    :param weightfile: file contain the weighting metric values
-  
-    """
-    # creating folders to put output data and plot
-    if not os.path.isdir("./plot_output"):
-        os.makedirs("./plot_output")
-    if not os.path.isdir("./plot_output/gaussian"):
-        os.makedirs("./plot_output/gaussian")
-    if not os.path.isdir("./plot_output/ecdf"):
-        os.makedirs("./plot_output/ecdf")
-   
+    :param nboot: the number of bootstrap resamples for the confidence bounds (no bounds if 0)
+    :param level: the confidence level of the bounds
+    :return the risk result (see risk_assessment) with the forecast details
+            (sta_name, climayears, forecastyear, forecast_date)
+    """
     # set up actual dates for the x axis representation
     date = dt.datetime(forecastyear, forecastmonth, forecastday).date()
     f_date = date.strftime('%d-%b-%Y')
@@ -67,17 +65,11 @@ def risk_prob_plot(climastartyear, climaendyear, forecastyear, forecastmonth, fo
         message = "WARNING: The last %s year of climatology years has been removed \n" \
                   "only %s ensembles are used!" % (ny_del, len(climayears))
         print message
-    else:
-        climayears = climayears
 
-    # reading necessary files required for tamsat-alert
-    # generate weighting metric file
-    # This function will make a weighting file from rainfall or temperature
-    # from the given GLAM weather inputs. If one wants to weight with a different
-    # variable the text file should be given in tamsat_alert directory with two
-    # column 1= climayears 2= weighing metric values. File should have one line of header.
-    weighting.weight_metric_prep(climayears, wth_path, sta_name, f_date, weight_var,
-                                 wf_year, wf_month, wf_day, w_leadtime, weightfile)
+    # the weighting metric from rainfall or temperature of the GLAM weather inputs
+    # (not saved, see save_risk)
+    wmetric = weighting.weight_metric_prep(climayears, wth_path, sta_name, f_date, weight_var,
+                                           wf_year, wf_month, wf_day, w_leadtime, None)
 
     # read climatology time series (This file is created during crop yield forecast)
     climametric = np.genfromtxt(climafile, skip_header=1)[:, 1]
@@ -85,288 +77,415 @@ def risk_prob_plot(climastartyear, climaendyear, forecastyear, forecastmonth, fo
     # read forecast ensemble time series (This file is created during crop yield forecast)
     forecametric = np.genfromtxt(forecastfile, skip_header=1)[:, 1]
 
-    # read Weighting metric time series (This file is created by weighting metric prep)
-    # this only work for GLAM format so one has to write its own code or provide specific
-    # file with two column 1, climayears 2, weight metric value (header must be given in the file)
-    wmetric = np.genfromtxt(weightfile, skip_header=1)[:, 1]
-
-    # calculating probability distribution
-    # threshold probability 
-    thresholds = np.arange(0.01, 1.01, 0.01)
-
-    # calculate the mean and sd of the climatology
-    climamean = np.mean(climametric)
-    climasd = np.std(climametric)
-    
-    # calculate the mean and sd of the the projected
-    # yield based on climatology weather data
-    # we need the weighted yield forecast
-    projmean, projsd = weight_forecast(forecametric, wmetric, weights)
-    projsd = np.maximum(projsd, 0.001)  # avoid division by zero
+    result = risk_assessment(climametric, forecametric, wmetric, weights, stat, nboot, level)
+    result.update({'sta_name': sta_name, 'climayears': climayears, 'forecastyear': forecastyear,
+                   'forecast_date': f_date})
+    return result
 
-    if stat == 'normal':
-        # calculate the normal distribution
-        probabilityyields = []
-        for z in range(0, len(thresholds)):
-            thres = sps.norm.ppf(thresholds[z], climamean, climasd)
-            probyield = sps.norm.cdf(thres, projmean, projsd)
-            probabilityyields = np.append(probabilityyields, probyield)
-            del probyield         
-        np.savetxt('./data_output/probyield_normal.txt', probabilityyields.T, fmt='%0.2f')
-       
-    elif stat == 'ecdf':
-        # calculate the empirical distribution
-        ecdf_clima = ECDF(climametric)
-        probabilityyields = []
-        for z in range(0, len(ecdf_clima.x)):
-            thres = ecdf_clima.x[z]  # (thresholds[z])
-            ecdf_proj = ECDF(forecametric)
-            probyield = ecdf_proj(thres)
-            probabilityyields = np.append(probabilityyields, probyield)
-            del probyield
-        np.savetxt('./data_output/probyield_ecdf.txt', probabilityyields.T, fmt='%0.2f')
-    else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')
 
-    # Plots of results
-    # Risk probability plot (original format ECB)
-    sns.set_style("ticks")
-    fig = plt.figure(figsize=(8, 6))
-    ax = plt.subplot(111)
+def risk_assessment(climametric, forecametric, wmetric, weights, stat, nboot=0, level=0.9, seed=None):
+    """
+    This function calculate the risk of a forecast and return all the results
+    in a dictionary. It has no side effect (no file or plot).
+    :param climametric: climatological values of the metric under investigation
+    :param forecametric: ensembles forecast values of the metric under investigation
+    :param wmetric: the weighting metric values of the ensemble members
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param stat: statistical method to be used for probability distribution comparison (ecdf or norm)
+    :param nboot: the number of bootstrap resamples for the confidence bounds (no bounds if 0)
+    :param level: the confidence level of the bounds
+    :param seed: the seed of the bootstrap resamples
+    :return a dictionary with
+            stat: the statistical method
+            thresholds: the climatological percentiles of the risk curve
+            probabilities: the probability of the forecast to be below each threshold
+            category_index: the index of the upper bound of the first four categories in the curve
+            categories: the probability of the categories very low, low, average, high and very high
+            projected_mean, projected_sd: the weighted mean and sd of the forecast ensemble
+            climametric, forecametric, wmetric: the input values
+            and, if nboot is given, the confidence bounds (see bootstrap_risk)
+    """
+    climametric = np.asarray(climametric, dtype=float)
+    forecametric = np.asarray(forecametric, dtype=float)
+    wmetric = np.asarray(wmetric, dtype=float)
+    probabilityyields, categories = risk_probabilities(climametric, forecametric, wmetric, weights, stat)
     if stat == 'normal':
-        # Plot using normal distribution
-        plt.plot(thresholds*100, thresholds, '--k', lw=1, label='Climatology')
-        line = plt.plot(thresholds*100, probabilityyields, 'k', lw=1, label='Projected')
-        # indicating critical points
-        highlight_point(ax, line[0], [thresholds[79]*100, probabilityyields[79]], 'g')  # below average
-        highlight_point(ax, line[0], [thresholds[59]*100, probabilityyields[59]], 'y')  # below average
-        highlight_point(ax, line[0], [thresholds[39]*100, probabilityyields[39]], 'm')  # below average
-        highlight_point(ax, line[0], [thresholds[19]*100, probabilityyields[19]], 'r')  # well below average
-      
-    elif stat == 'ecdf':
-        # Plot using empirical cumulative distribution
-        plt.plot(ecdf_clima.y*100, ecdf_clima.y, '--k', lw=1, label='Climatology')
-        line = plt.plot(ecdf_clima.y*100, probabilityyields, 'k', lw=1, label='Projected')
-        # identifying the index for the critical points
-        nn = int(round(len(climayears)/5., 0))  # this should be an integer
-        wba_i = nn 
-        ba_i = (nn * 2) 
-        a_i = (nn * 3) 
-        av_i = (nn * 4) 
-        # indicating critical points
-        highlight_point(ax, line[0], [ecdf_clima.y[av_i]*100, probabilityyields[av_i]], 'g')  # below average
-        highlight_point(ax, line[0], [ecdf_clima.y[a_i]*100, probabilityyields[a_i]], 'y')  # below average
-        highlight_point(ax, line[0], [ecdf_clima.y[ba_i]*100, probabilityyields[ba_i]], 'm')  # below average
-        highlight_point(ax, line[0], [ecdf_clima.y[wba_i]*100, probabilityyields[wba_i]], 'r')  # well below average
-    
+        thresholds = np.arange(0.01, 1.01, 0.01)
+        index = NORMAL_CATEGORY_INDEX
     else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')
+        # the climatological percentiles of the ecdf thresholds
+        thresholds = np.arange(len(climametric) + 1) / float(len(climametric))
+        index = ecdf_category_index(len(climametric))
+    projmean, projsd = weight_forecast(forecametric, wmetric, weights)
+    result = {'stat': stat, 'thresholds': thresholds, 'probabilities': probabilityyields,
+              'category_index': index, 'categories': categories,
+              'projected_mean': float(projmean[0]), 'projected_sd': float(projsd),
+              'climametric': climametric, 'forecametric': forecametric, 'wmetric': wmetric}
+    if nboot:
+        result.update(bootstrap_risk(climametric, forecametric, wmetric, weights, stat, nboot, level, seed))
+    return result
 
-    plt.title('Theme: Probability of yield estimate (against ' + str(climastartyear) + '-' + str(climaendyear) +
-              ' climatology)\nLocation: ' + sta_name + '\nForecast date: ' + f_date, loc='left', fontsize=14)
-    plt.xlabel('Climatology', fontsize=14)
-    plt.ylabel('Probability <= Climatological percentile', fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.legend()
-    plt.tight_layout()
-    if stat == 'normal': 
-        path = './plot_output/gaussian/'
-    elif stat == 'ecdf':
-        path = './plot_output/ecdf/'
-    else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')
-    fig.savefig(path + sta_name+'_'+f_date+'_yieldprob.png', dpi=300)
-    plt.close()
 
-    # Risk probability plot (Pentiles bar plot format DA)
-    pp = []
-    sns.set_style("ticks")
-    fig = plt.figure(figsize=(8, 6))
-    if stat == 'normal':
-        verylow = probabilityyields[19] 
-        low = probabilityyields[39] - verylow
-        average = probabilityyields[59] - (verylow+low)    
-        high = probabilityyields[79] - (verylow+low+average)
-        veryhigh = 1 - (verylow+low+average+high)
-    elif stat == 'ecdf':
-
-        # identifying the index for the critical points
-        nn = int(round(len(climayears)/5., 0))  # this should be an integer
-        wba_i = nn 
-        ba_i = (nn * 2) 
-        a_i = (nn * 3) 
-        av_i = (nn * 4) 
-        
-        verylow = probabilityyields[wba_i] 
-        low = probabilityyields[ba_i] - probabilityyields[wba_i]  # verylow
-        average = probabilityyields[a_i] - probabilityyields[ba_i]  # (verylow+low)
-        high = probabilityyields[av_i] - probabilityyields[a_i]  # (verylow+low+average)
-        veryhigh = 1 - probabilityyields[av_i]  # (verylow+low+average+high)
-    else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')    
-
-    val = [verylow, low, average, high, veryhigh]   # the bar lengths
-    pos = np.arange(5)+.5        # the bar centers on the y axis
-    plt.barh(pos[0], val[0]*100, align='center', color='r', label='Very low (0-20%)')
-    plt.barh(pos[1], val[1]*100, align='center', color='m', label='Low (20-40%)')
-    plt.barh(pos[2], val[2]*100, align='center', color='grey', label='Average (40-60%)')
-    plt.barh(pos[3], val[3]*100, align='center', color='b', label='High (60-80%)')
-    plt.barh(pos[4], val[4]*100, align='center', color='g', label='Very high (80-100%)')
-    
-    plt.annotate(str(round(val[0]*100, 1))+'%', ((val[0]*100)+1, pos[0]), xytext=(0, 1), textcoords='offset points', fontsize=20)
-    plt.annotate(str(round(val[1]*100, 1))+'%', ((val[1]*100)+1, pos[1]), xytext=(0, 1), textcoords='offset points', fontsize=20)
-    plt.annotate(str(round(val[2]*100, 1))+'%', ((val[2]*100)+1, pos[2]), xytext=(0, 1), textcoords='offset points', fontsize=20)
-    plt.annotate(str(round(val[3]*100, 1))+'%', ((val[3]*100)+1, pos[3]), xytext=(0, 1), textcoords='offset points', fontsize=20)
-    plt.annotate(str(round(val[4]*100, 1))+'%', ((val[4]*100)+1, pos[4]), xytext=(0, 1), textcoords='offset points', fontsize=20)
-
-    plt.yticks(pos, ('Very low', 'Low', 'Average', 'High', 'Very high'), fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.xlabel('Probability', fontsize=14)
-    plt.title('Theme: Probability of yield estimate (against ' + str(climastartyear) + '-' + str(climaendyear) +
-              ' climatology)\nLocation: ' + sta_name+'\nForecast date: ' + f_date, loc='left', fontsize=14)
-    plt.xlim(0, 101)
-    plt.legend()
-    plt.tight_layout()
-    if stat == 'normal': 
-        path = './plot_output/gaussian/'
-    elif stat == 'ecdf':
-        path = './plot_output/ecdf/'
+def bootstrap_risk(climametric, forecametric, wmetric, weights, stat, nboot=1000, level=0.9, seed=None):
+    """
+    This function calculate the confidence bounds of the risk curve and of the probability
+    of the categories by resampling the ensemble members (with their weighting metric) and
+    the climatological values with replacement. All the resamples are calculated at once
+    as a batch of forecasts (see batch_risk).
+    :param climametric: climatological values of the metric under investigation
+    :param forecametric: ensembles forecast values of the metric under investigation
+    :param wmetric: the weighting metric values of the ensemble members
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param stat: statistical method to be used for probability distribution comparison (ecdf or norm)
+    :param nboot: the number of resamples
+    :param level: the confidence level of the bounds (e.g. 0.9 for the 5th and 95th percentiles)
+    :param seed: the seed of the random resamples
+    :return a dictionary with the lower and upper bounds of the risk curve (probabilities_bounds,
+            2 x threshold) and of the categories (categories_bounds, 2 x 5), nboot and level
+    """
+    climametric = np.asarray(climametric, dtype=float)
+    forecametric = np.asarray(forecametric, dtype=float)
+    wmetric = np.asarray(wmetric, dtype=float)
+    rng = np.random.RandomState(seed)
+    members = rng.randint(0, len(forecametric), (nboot, len(forecametric)))
+    years = rng.randint(0, len(climametric), (nboot, len(climametric)))
+    probabilityyields, categories = batch_risk(climametric[years], forecametric[members], wmetric[members],
+                                               weights, stat)
+    percentiles = [50 * (1 - level), 50 * (1 + level)]
+    return {'probabilities_bounds': np.percentile(probabilityyields, percentiles, axis=0),
+            'categories_bounds': np.percentile(categories, percentiles, axis=0),
+            'nboot': nboot, 'level': level}
+
+
+def save_risk(result, path='./data_output/', weightfile=None):
+    """
+    This function save the risk curve (probyield_<stat>.txt) and the probability
+    of each category (RiskProbability.txt) of a risk result, with their lower and
+    upper confidence bounds when the result has them (see bootstrap_risk).
+    :param result: the risk result (see risk_assessment)
+    :param path: the folder of the text files
+    :param weightfile: if given, the weighting metric of the climatological years
+                       (result of risk_forecast) is saved in this file
+    :return the probability (%) of each category
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    bounds = 'categories_bounds' in result
+    if bounds:
+        # the curve with its lower and upper confidence bounds
+        np.savetxt(os.path.join(path, 'probyield_' + result['stat'] + '.txt'),
+                   np.vstack([result['probabilities'], result['probabilities_bounds']]).T, fmt='%0.2f')
     else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')
+        np.savetxt(os.path.join(path, 'probyield_' + result['stat'] + '.txt'), result['probabilities'].T,
+                   fmt='%0.2f')
 
-    # append the probabilities to pp
-    pp = np.append(pp, round(val[0]*100, 1))
-    pp = np.append(pp, round(val[1]*100, 1))
-    pp = np.append(pp, round(val[2]*100, 1))
-    pp = np.append(pp, round(val[3]*100, 1))
-    pp = np.append(pp, round(val[4]*100, 1))
-    
-    fig.savefig(path + sta_name+'_'+f_date+'_pentile.png', dpi=300)
-    plt.close()
-    
     # save the probabilities of each category on a text file
+    pp = np.array([round(val * 100, 1) for val in result['categories']])
     headval = '1 = Very low(0-20%)  2 = Low(20-40%)   3 = Average(40-60%)  4 = High(60-80%)  5 = Very high(80-100%)\n\
 Category    Probability'
     category = [1, 2, 3, 4, 5]
-    rp = np.array([category, pp])
-    rp = rp.T
-    np.savetxt('./data_output/RiskProbability.txt', rp, delimiter=' ', header=headval, fmt='%i   %6.2f')
+    if bounds:
+        headval += '    Lower(%g%%)    Upper(%g%%)' % (result['level'] * 100, result['level'] * 100)
+        rp = np.vstack([category, pp, np.round(result['categories_bounds'] * 100, 1)]).T
+        np.savetxt(os.path.join(path, 'RiskProbability.txt'), rp, delimiter=' ', header=headval,
+                   fmt='%i   %6.2f   %6.2f   %6.2f')
+    else:
+        rp = np.array([category, pp])
+        rp = rp.T
+        np.savetxt(os.path.join(path, 'RiskProbability.txt'), rp, delimiter=' ', header=headval, fmt='%i   %6.2f')
+
+    if weightfile is not None:
+        weightmetric_ts = np.array([result['climayears'], result['wmetric']]).T
+        np.savetxt(weightfile, weightmetric_ts, delimiter=' ', header='ClimaYears    WeightMetricValue',
+                   fmt='%i    %6.2f')
+    return pp
 
-    # probability density plot
-    sns.set_style("ticks")
-    fig = plt.figure(figsize=(8, 6))
-    if stat == 'normal':
-        # Plot using normal distribution
-        sns.kdeplot(climametric, bw=10, shade=True, label='Climatology', cumulative=False)
-        sns.kdeplot(forecametric, bw=10, shade=False, color='g', label='Projected', cumulative=False)
 
-    elif stat == 'ecdf':
-        # Plot using empirical cumulative distribution
-        sns.kdeplot(climametric, bw=10, shade=True, label='Climatology', cumulative=False)
-        sns.kdeplot(forecametric, bw=10, shade=False, label='Projected', cumulative=False)
+def plot_risk(result, climastartyear, climaendyear, processes=None, dpi=300, fmt='png'):
+    """
+    This function plot the risk result of a single date forecast (result of risk_forecast):
+    the risk curve, the probability of the categories, the probability density and
+    the histogram of the forecast ensemble (see plot_render.risk_jobs).
+    :param result: the risk result (see risk_forecast)
+    :param climastartyear: the year climatology value start.
+    :param climaendyear: the year climatology value end.
+    :param processes: if given, the plots are rendered on this number of processes
+    :param dpi: the resolution of the plots
+    :param fmt: the format of the plots (png, pdf, svg...)
+    :return the list of the plot files
+    """
+    return plot_render.render(plot_render.risk_jobs(result, climastartyear, climaendyear, dpi=dpi, fmt=fmt),
+                              processes)
 
-    else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')
-    plt.title('Theme: Probability of yield estimate (against ' + str(climastartyear)+'-' + str(climaendyear) +
-              ' climatology)\nLocation: ' + sta_name + '\nForecast date: ' + f_date, loc='left', fontsize=14)
-    plt.xlabel('Yield (Kg/ha)', fontsize=14)
-    plt.ylabel('Probability density', fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.legend()
-    plt.tight_layout()
-    if stat == 'normal': 
-        path = './plot_output/gaussian/'
-    elif stat == 'ecdf':
-        path = './plot_output/ecdf/'
-    else:
-        raise ValueError('Please use only "normal" or "ecdf" stat method')
-    fig.savefig(path + sta_name + '_' + f_date + '_ked_plot.png', dpi=300)
-    plt.close()
-
-    # histogram plot
-    sns.set_style("ticks")
-    fig = plt.figure(figsize=(8, 6))
-    binboundaries = np.linspace(min(forecametric)-(0.01*(min(forecametric))), max(forecametric)+(0.01*(max(forecametric))), 10)
-    sns.distplot(forecametric, bins=binboundaries, hist=True, kde=False, label=f_date, hist_kws={"color": "b"})
-    plt.xlabel('Yield ($\mathregular{Kg ha^{-1}}$)', fontsize=14)
-    plt.ylabel('Frequency', fontsize=14)
-    plt.title('Theme: Probability of yield estimate (against ' + str(climastartyear) + '-' + str(climaendyear) +
-              ' climatology)\nLocation: ' + sta_name + '\nForecast date: ' + f_date, loc='left', fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.xlim(min(forecametric)-(0.01*(min(forecametric))), max(forecametric)+(0.01*(max(forecametric))))
-    plt.ylim(0, len(forecametric)+1)
-    plt.tight_layout()                
-    fig.savefig(path + sta_name + '_' + f_date + '_hist_plot.png', dpi=300)
-    plt.close()
+
+def risk_prob_plot(climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
+                   stat, sta_name, wth_path, weights, weight_var, wf_year, wf_month, wf_day,
+                   w_leadtime, climafile, forecastfile, weightfile):
+    """
+    This function plot the probability estimates for poor yield for a single date
+    forecast given in the configuration file: the risk is calculated (risk_forecast),
+    saved in the text files (save_risk) and plotted (plot_risk and cum_plots).
+    The parameters are the same as risk_forecast.
+    :param weightfile: file contain the weighting metric values
+    :return the probability (%) of each category
+    """
+    result = risk_forecast(climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
+                           stat, sta_name, wth_path, weights, weight_var, wf_year, wf_month, wf_day,
+                           w_leadtime, climafile, forecastfile)
+    pp = save_risk(result, weightfile=weightfile)
+    plot_risk(result, climastartyear, climaendyear)
 
     # plot additional variables of the input data
     cum_plots(climastartyear, climaendyear, forecastyear, sta_name, wth_path, weights)
     return pp
 
-        
-def highlight_point(ax, line, point, c, linestyle=':'):
-    """
-    This is an extra function to highlight three of the probability
-    points on the plot. It is part of the main plotting function.
-    """
-    label = ['well below average = ', 'Below average = ', 'Average = ', 'Above average = ']
-    c = c 
-    xmin = 0  # ax.get_xlim()[0]
-    ymin = 0  # ax.get_ylim()[0]
-    if c == 'r':
-        label = label[0]
-    elif c == 'm':
-        label = label[1]
-    elif c == 'y':
-        label = label[2]
-    elif c == 'g':
-        label = label[3]
+
+def risk_probabilities(climametric, forecametric, wmetric, weights, stat):
+    """
+    This function calculate the probability of the forecast metric to be below
+    the climatological percentiles and the probability of the five categories.
+    It has no side effect (no file or plot) so it can be used for many forecasts
+    (e.g. hindcast).
+    :param climametric: climatological values of the metric under investigation
+    :param forecametric: ensembles forecast values of the metric under investigation
+    :param wmetric: the weighting metric values of the ensemble members
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param stat: statistical method to be used for probability distribution comparison (ecdf or norm)
+    :return a tuple (probabilityyields, categories): the probability of the forecast to be
+            below each climatological percentile (normal) or climatological value (ecdf)
+            and the probability of the categories very low, low, average, high and very high
+    """
+    probabilityyields, categories = batch_risk([climametric], [forecametric], [wmetric], weights, stat)
+    return probabilityyields[0], categories[0]
+
+
+def batch_risk(climametric, forecametric, wmetric, weights, stat):
+    """
+    This function calculate the risk curves and the probability of the five categories
+    of many forecasts (e.g. stations or forecast dates) at once.
+    :param climametric: climatological values of the metric (case x climatological year)
+    :param forecametric: ensembles forecast values of the metric (case x member)
+    :param wmetric: the weighting metric values of the ensemble members (case x member)
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param stat: statistical method to be used for probability distribution comparison (ecdf or norm)
+    :return a tuple (probabilityyields (case x threshold), categories (case x 5))
+    """
+    climametric = np.atleast_2d(np.asarray(climametric, dtype=float))
+    forecametric = np.atleast_2d(np.asarray(forecametric, dtype=float))
+    wmetric = np.atleast_2d(np.asarray(wmetric, dtype=float))
+
+    if stat == 'normal':
+        # threshold probability
+        thresholds = np.arange(0.01, 1.01, 0.01)
+
+        # calculate the mean and sd of the the projected
+        # yield based on climatology weather data
+        # we need the weighted yield forecast
+        projmean, projsd = weight_forecast(forecametric, wmetric, weights)
+        projsd = np.maximum(projsd, 0.001)  # avoid division by zero
+
+        # calculate the normal distribution (all the thresholds at once)
+        probabilityyields = normal_risk(np.mean(climametric, axis=1), np.std(climametric, axis=1),
+                                        projmean, projsd, thresholds)
+        categories = risk_categories(probabilityyields, NORMAL_CATEGORY_INDEX)
+
+    elif stat == 'ecdf':
+        # calculate the (weighted) empirical distribution
+        probabilityyields = ecdf_risk(climametric, forecametric, member_weights(wmetric, weights, forecametric))
+        categories = risk_categories(probabilityyields, ecdf_category_index(climametric.shape[1]))
     else:
-        raise ValueError('Only chose colors green,yellow or red')
-    ax.plot([xmin, point[0]], [point[1], point[1]], color=c, linestyle=linestyle, label=label+str(round(point[1], 2)))
-    ax.plot([point[0], point[0]], [ymin, point[1]], color=c, linestyle=linestyle)
-    return None
+        raise ValueError('Please use only "normal" or "ecdf" stat method')
+
+    return probabilityyields, categories
+
+
+def normal_risk(climamean, climasd, projmean, projsd, thresholds=None):
+    """
+    This function calculate the probability of the projected (normal) distribution
+    to be below the climatological percentiles for many cases (e.g. stations or
+    forecast dates) at once.
+    :param climamean: the mean of the climatology of each case (scalar or array)
+    :param climasd: the standard deviation of the climatology of each case
+    :param projmean: the (weighted) mean of the projected metric of each case
+    :param projsd: the (weighted) standard deviation of the projected metric of each case
+    :param thresholds: the climatological percentiles (default 0.01, 0.02, ... 1.0)
+    :return the probabilities (case x threshold), (threshold) for scalar inputs
+    """
+    if thresholds is None:
+        thresholds = np.arange(0.01, 1.01, 0.01)
+    climamean, climasd, projmean, projsd = [np.asarray(x, dtype=float)[..., None]
+                                            for x in (climamean, climasd, projmean, projsd)]
+    # the climatological value of each percentile (norm.ppf) compared with the projected distribution
+    thres = climamean + climasd * sps.norm.ppf(thresholds)
+    return sps.norm.cdf((thres - projmean) / projsd)
+
+
+def member_weights(wmetric, weights, forecametric):
+    """
+    This function return the weight of each ensemble member: the members are sorted
+    by the weighting metric (as in weight_forecast) and the tercile weights are given
+    to the lower, middle and upper third of the members.
+    :param wmetric: the weighting metric values of the ensemble members (... x member)
+    :param weights: tercile forecast probabilities of the weighting metric used (category),
+                    or one set of probabilities per scenario (scenario x category)
+    :param forecametric: ensembles forecast values of the metric (... x member), used to
+                         order the members with the same weighting metric value
+    :return the normalised weights of the members in their original order (... x member),
+            (scenario x member) for a single ensemble and many scenarios
+    """
+    wmetric = np.asarray(wmetric, dtype=float)
+    n_reps = wmetric.shape[-1] // np.shape(weights)[-1]
+    allweights = np.repeat(np.asarray(weights, dtype=float), n_reps, axis=-1)
+    allweights = allweights / np.sum(allweights, axis=-1)[..., None]
+    # the same order as sorted(zip(wmetric, forecametric)), the ensemble is sorted
+    # once for all the scenarios
+    order = np.lexsort((np.broadcast_to(forecametric, wmetric.shape), wmetric), axis=-1)
+    shape = np.broadcast(allweights, wmetric).shape
+    memberweights = np.empty(shape)
+    np.put_along_axis(memberweights, np.broadcast_to(order, shape), np.broadcast_to(allweights, shape), axis=-1)
+    return memberweights
+
+
+def ecdf_risk(climametric, forecametric, memberweights=None):
+    """
+    This function calculate the (weighted) empirical probability of the forecast
+    metric to be below each climatological value for many cases at once. The
+    thresholds are the climatological values in ascending order preceded by -inf
+    (as the ECDF of the climatology). The members are sorted once and the thresholds
+    of each case are found with a binary search in its finite members. The missing
+    (NaN) members are sorted last and left out of the cumulative weight.
+    :param climametric: climatological values of the metric (case x climatological year)
+    :param forecametric: ensembles forecast values of the metric (case x member)
+    :param memberweights: the weight of each member (case x member), equal weights if None
+    :return the probabilities (case x threshold), (threshold) for a single case
+    """
+    single = np.ndim(forecametric) == 1
+    climametric = np.atleast_2d(np.asarray(climametric, dtype=float))
+    forecametric = np.atleast_2d(np.asarray(forecametric, dtype=float))
+    ncases, nmembers = forecametric.shape
+    if memberweights is None:
+        memberweights = np.ones(forecametric.shape)
+    memberweights = np.where(np.isnan(forecametric), 0., np.broadcast_to(memberweights, forecametric.shape))
+
+    # the sorted members (NaN last) and the cumulative weight below and at each of them
+    order = np.argsort(forecametric, axis=1, kind='mergesort')
+    sortedmetric = np.take_along_axis(forecametric, order, axis=1)
+    cumweights = np.cumsum(np.take_along_axis(memberweights, order, axis=1), axis=1)
+    cumweights = np.hstack([np.zeros((ncases, 1)), cumweights / cumweights[:, -1:]])
+
+    thresholds = np.hstack([np.full((ncases, 1), -np.inf), np.sort(climametric, axis=1)])
+
+    # the number of members of each case at or below each of its thresholds
+    # (only the finite members, sorted before the NaN ones, are searched)
+    nfinite = np.sum(~np.isnan(forecametric), axis=1)
+    index = np.empty(thresholds.shape, dtype=int)
+    for c in range(0, ncases):
+        index[c] = np.searchsorted(sortedmetric[c, :nfinite[c]], thresholds[c], side='right')
+    probabilityyields = np.take_along_axis(cumweights, index, axis=1)
+    if single:
+        return probabilityyields[0]
+    return probabilityyields
+
+
+def ecdf_category_index(nclima):
+    """
+    This function return the index of the upper bound of the first four categories
+    in the ecdf risk curve of nclima climatological values.
+    """
+    nn = int(round(nclima/5., 0))  # this should be an integer
+    return [nn, nn * 2, nn * 3, nn * 4]
+
+
+def risk_categories(probabilityyields, index):
+    """
+    This function calculate the probability of the five categories (very low, low,
+    average, high, very high) from the risk curve of one or many cases.
+    :param probabilityyields: the risk curve (... x threshold)
+    :param index: the index of the upper bound of the first four categories in the curve
+    :return the probability of the categories (... x 5)
+    """
+    probabilityyields = np.asarray(probabilityyields)
+    bounds = probabilityyields[..., index]
+    zeros = np.zeros(bounds.shape[:-1] + (1,))
+    return np.diff(np.concatenate([zeros, bounds, zeros + 1], axis=-1), axis=-1)
 
 
 def weight_forecast(forecametric, wmetric, weights):
-    fy_wmean = []
-    # the metric for ordering the true metric(forecametric)
-    # is total precipitation or mean temperature.
-    out = zip(wmetric, forecametric)  # put the metric with true metric (forecametric)
-    out = sorted(out)  # sort in  ascending order based on the metric
-    out = np.array(out)  # convert it to array
-    # weighting forecast metric with the weighting metric
-    n_reps = np.shape(out)[0] / len(weights) 
-    allweights = []
-    for j in range(0, len(weights)):
-        allweights = np.append(allweights, np.repeat(weights[j], n_reps))
-    allweights = (allweights/sum(allweights))
-    # weighted average of forecasted yield after being sorted by the metric
-    a = np.average(out[:, 1], weights=allweights)
-    fy_wmean = np.append(fy_wmean, a)  # projected weighted mean
+    """
+    This function calculate the weighted mean and standard deviation of the forecast
+    ensemble: the members sorted by the weighting metric are given the tercile weights
+    (see member_weights).
+    :param forecametric: ensembles forecast values of the metric (member), or (case x member)
+    :param wmetric: the weighting metric values of the ensemble members (same shape)
+    :param weights: tercile forecast probabilities of the weighting metric used (category),
+                    or one set of probabilities per scenario (scenario x category)
+    :return a tuple (projected weighted mean, projected weighted sd), of each case or
+            scenario. For a single ensemble and weights the mean is an array of one value
+            and the sd a float.
+    """
+    forecametric = np.asarray(forecametric, dtype=float)
+    memberweights = member_weights(wmetric, weights, forecametric)
+    # weighted average of forecasted yield
+    fy_wmean = np.sum(memberweights * forecametric, axis=-1)  # projected weighted mean
     # projected weighted standard deviation
-    variance = np.average((forecametric-fy_wmean)**2, weights=allweights)  
-    fy_wsd = np.sqrt(variance) 
-    del allweights
+    variance = np.sum(memberweights * (forecametric - fy_wmean[..., None])**2, axis=-1)
+    fy_wsd = np.sqrt(variance)
+    if np.ndim(fy_wmean) == 0:
+        return np.array([fy_wmean]), float(fy_wsd)
     return fy_wmean, fy_wsd
 
 
-def cum_plots(climastartyear, climaendyear, forecastyear, sta_name, wth_path, weights):
+def weight_scenarios(climametric, forecametric, wmetric, weights, stat):
+    """
+    This function calculate the risk of a forecast ensemble for many weighting
+    scenarios (e.g. the tercile forecasts of different models, grid cells or issue
+    dates) at once. The ensemble is sorted by the weighting metric once for all the
+    scenarios (see member_weights).
+    :param climametric: climatological values of the metric under investigation
+    :param forecametric: ensembles forecast values of the metric under investigation
+    :param wmetric: the weighting metric values of the ensemble members
+    :param weights: tercile forecast probabilities of each scenario (scenario x category)
+    :param stat: statistical method to be used for probability distribution comparison (ecdf or norm)
+    :return a dictionary with the projected weighted mean and sd (scenario), the risk
+            curve (scenario x threshold) and the probability of the categories (scenario x 5)
     """
+    climametric = np.asarray(climametric, dtype=float)
+    forecametric = np.asarray(forecametric, dtype=float)
+    weights = np.atleast_2d(weights)
+    memberweights = member_weights(wmetric, weights, forecametric)
+    projmean, projsd = weight_forecast(forecametric, wmetric, weights)
+
+    if stat == 'normal':
+        probabilityyields = normal_risk(np.mean(climametric), np.std(climametric), projmean,
+                                        np.maximum(projsd, 0.001))
+        index = NORMAL_CATEGORY_INDEX
+    elif stat == 'ecdf':
+        probabilityyields = ecdf_risk(np.broadcast_to(climametric, (len(weights), len(climametric))),
+                                      np.broadcast_to(forecametric, memberweights.shape), memberweights)
+        index = ecdf_category_index(len(climametric))
+    else:
+        raise ValueError('Please use only "normal" or "ecdf" stat method')
+
+    return {'projected_mean': projmean, 'projected_sd': projsd, 'probabilities': probabilityyields,
+            'categories': risk_categories(probabilityyields, index)}
+
+
+def climate_summary(climastartyear, climaendyear, forecastyear, sta_name, wth_path, weights):
+    """
+    This function prepare the weather of the forecast year and the climatology average
+    plotted by cum_plots.
     :param climastartyear: the year climatology value start.
     :param climaendyear: the year climatology value end.
     :param forecastyear: the year for which we are going to forecast yield
                          from historical climatic weather.
-    :param forecastyear: the year forecast start.
     :param sta_name: the name of the station or point.
     :param wth_path: the path of the wth file (where the weather data is.)
     :param weights: the tercile forecast weights
 
-    :return None 
-   """
+    :return a dictionary with the forecast year cumulative rainfall (cumprecip), minimum and maximum
+            temperature (tmin, tmax) and short wave radiation (swr), their climatology average
+            (av_cumprecip, av_tmin, av_tmax, av_swr), the climatological years, forecastyear and sta_name
+    """
     climayears = np.arange(climastartyear, climaendyear+1)
 
     # warning that certain number of years have been removed from the climatology
@@ -377,103 +496,36 @@ def cum_plots(climastartyear, climaendyear, forecastyear, sta_name, wth_path, we
         message = "WARNING: The last %s year of climatology years has been removed \n " \
                   "only %s ensembles are used!" % (ny_del, len(climayears))
         print message
-    else:
-        climayears = climayears
 
     path = wth_path
     # read the file containing the forecast year weather data
-    forecastyeardata = np.genfromtxt(path+'origi_'+sta_name+'001001'+str(forecastyear)+'.wth', skip_header=4)
-
-    # reading the climatological years data
-    precip = forecastyeardata[:, 4]
-    cumprecip = np.cumsum(precip)
-
-    tmin = forecastyeardata[:, 3]
-    tmax = forecastyeardata[:, 2]
-    swr = forecastyeardata[:, 1]
-    
-    climarain_all = []
-    climatmin_all = []
-    climatmax_all = []
-    climaswr_all = []
-    for i in range(0, len(climayears)):
-        # read the file containing the climatological weather data
-        climadata = np.genfromtxt(path+sta_name+'001001'+str(climayears[i])+'.wth', skip_header=4)
-        climarain = climadata[:, 4]
-        climarain = np.cumsum(climarain)
-        climarain_all = np.append(climarain_all, climarain)
-
-        climatmin = climadata[:, 3]
-        climatmin_all = np.append(climatmin_all, climatmin)
-
-        climatmax = climadata[:, 2]
-        climatmax_all = np.append(climatmax_all, climatmax)
-
-        climaswr = climadata[:, 1]
-        climaswr_all = np.append(climaswr_all, climaswr)
-        
-    climarain_all = np.reshape(climarain_all, (len(climayears), 365))
-    climatmin_all = np.reshape(climatmin_all, (len(climayears), 365))
-    climatmax_all = np.reshape(climatmax_all, (len(climayears), 365))
-    climaswr_all = np.reshape(climaswr_all, (len(climayears), 365))
-
-    av_rain = np.mean(climarain_all, axis=0)
-    av_tmin = np.mean(climatmin_all, axis=0)
-    av_tmax = np.mean(climatmax_all, axis=0)
-    av_swr = np.mean(climaswr_all, axis=0)
-
-    fig = plt.figure(figsize=(8, 6))
-    sns.set_style("ticks")
-    plt.plot(cumprecip, 'b', label=str(forecastyear))
-    plt.plot(av_rain, 'r', label='Climatology average ('+str(climayears[0])+'-'+str(climayears[-1])+')')
-    plt.xlabel('DOY', fontsize=14)
-    plt.ylabel('Precipitation (mm)', fontsize=14)
-    plt.title('Theme: Cumulative rainfall\nLocation: '+sta_name, loc='left', fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.legend()
-    plt.tight_layout()                
-    fig.savefig('./plot_output/cum_precip.png', dpi=300)
-    plt.close()
-
-    fig = plt.figure(figsize=(8, 6))
-    sns.set_style("ticks")
-    plt.plot(tmin, 'b', label=str(forecastyear))
-    plt.plot(av_tmin, 'r', label='Climatology average ('+str(climayears[0])+'-'+str(climayears[-1])+')')
-    plt.xlabel('DOY', fontsize=14)
-    plt.ylabel('Temperature (C)', fontsize=14)
-    plt.title('Theme: Minimum Temperature\nLocation: '+sta_name, loc='left', fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.legend()
-    fig.tight_layout()
-    plt.savefig('./plot_output/tmin.png', dpi=300)
-    plt.close()
-
-    fig = plt.figure(figsize=(8, 6))
-    sns.set_style("ticks")
-    plt.plot(tmax, 'b', label=str(forecastyear))
-    plt.plot(av_tmax, 'r', label='Climatology average ('+str(climayears[0])+'-'+str(climayears[-1])+')')
-    plt.xlabel('DOY', fontsize=14)
-    plt.ylabel('Temperature (C)', fontsize=14)
-    plt.title('Theme: Maximum Temperature\nLocation: '+sta_name, loc='left', fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.legend()
-    plt.tight_layout()                
-    fig.savefig('./plot_output/tmax.png', dpi=300)
-    plt.close()
-
-    fig = plt.figure(figsize=(8, 6))
-    sns.set_style("ticks")
-    plt.plot(swr, 'b', label=str(forecastyear))
-    plt.plot(av_swr, 'r', label='Climatology average ('+str(climayears[0])+'-'+str(climayears[-1])+')')
-    plt.xlabel('DOY', fontsize=14)
-    plt.ylabel('SWR (MJ m-2 day-1)', fontsize=14)
-    plt.title('Theme: Short Wave Radiation\nLocation: '+sta_name, loc='left', fontsize=14)
-    plt.xticks(fontsize=14)
-    plt.yticks(fontsize=14)
-    plt.legend()
-    plt.tight_layout()                
-    fig.savefig('./plot_output/swr.png', dpi=300)
-    plt.close()
+    forecastyeardata = read_wth(wth_filename(path, 'origi_'+sta_name, forecastyear))
+
+    # the climatology average (persistent store of each station and climatology window)
+    summary = clima_store.load_summary(path, sta_name, climayears)
+    summary.update({'cumprecip': np.cumsum(forecastyeardata[:, 4]), 'tmin': forecastyeardata[:, 3],
+                    'tmax': forecastyeardata[:, 2], 'swr': forecastyeardata[:, 1],
+                    'climayears': climayears, 'forecastyear': forecastyear, 'sta_name': sta_name})
+    return summary
+
+
+def cum_plots(climastartyear, climaendyear, forecastyear, sta_name, wth_path, weights,
+              processes=None, dpi=300, fmt='png'):
+    """
+    This function plot the weather of the forecast year against the climatology average
+    (see climate_summary and plot_render.climate_jobs).
+    :param climastartyear: the year climatology value start.
+    :param climaendyear: the year climatology value end.
+    :param forecastyear: the year for which we are going to forecast yield
+                         from historical climatic weather.
+    :param sta_name: the name of the station or point.
+    :param wth_path: the path of the wth file (where the weather data is.)
+    :param weights: the tercile forecast weights
+    :param processes: if given, the plots are rendered on this number of processes
+    :param dpi: the resolution of the plots
+    :param fmt: the format of the plots (png, pdf, svg...)
+
+    :return the list of the plot files
+   """
+    summary = climate_summary(climastartyear, climaendyear, forecastyear, sta_name, wth_path, weights)
+    return plot_render.render(plot_render.climate_jobs(summary, dpi=dpi, fmt=fmt), processes)
@@ -0,0 +1,124 @@
+# =============================================================#
+# Persistent store of the climatology weather summaries
+# ============================================================#
+# The climatology average of the daily cumulative rainfall,
+# minimum and maximum temperature and short wave radiation
+# plotted against the forecast year (calcrisk.cum_plots) only
+# depend on the station and the climatology years, not on the
+# forecast date. This module keep the summary of each (station,
+# climatology window) in STORE_PATH with the signature of the
+# weather files it was calculated from (size, modification time
+# and content hash), so the summary is calculated from the .wth
+# files only when they changed. The weather files are written
+# again by every run, so a changed modification time with the
+# same content keeps the summary.
+# ==============================================================#
+import numpy as np
+import os
+import json
+import hashlib
+from wthfile import wth_filename, read_wth_files
+
+STORE_PATH = './clima_store/'
+
+# number of summaries loaded from the store (hits) and calculated (misses)
+stats = {'hits': 0, 'misses': 0}
+
+
+def summary_paths(sta_name, climayears):
+    """
+    This function return the names of the summary file and of its metadata
+    file for a station and climatology window.
+    """
+    key = '%s_%s_%s' % (sta_name, climayears[0], climayears[-1])
+    return STORE_PATH + key + '.npz', STORE_PATH + key + '.json'
+
+
+def source_stamp(filenames):
+    """
+    This function return the size and modification time of the weather files.
+    """
+    stamp = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamp.append([stat.st_size, stat.st_mtime])
+    return stamp
+
+
+def source_digest(filenames):
+    """
+    This function calculate the sha1 hash of the content of the weather files.
+    """
+    sha = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def summarise(weather):
+    """
+    This function calculate the climatology average of the daily weather.
+    :param weather: the weather data of the climatological years (year x day x [date, srad, tmax, tmin, rain])
+    :return a dictionary with the average cumulative rainfall (av_cumprecip), minimum and
+            maximum temperature (av_tmin, av_tmax) and short wave radiation (av_swr) of each day
+    """
+    return {'av_cumprecip': np.mean(np.cumsum(weather[:, :, 4], axis=1), axis=0),
+            'av_tmin': np.mean(weather[:, :, 3], axis=0), 'av_tmax': np.mean(weather[:, :, 2], axis=0),
+            'av_swr': np.mean(weather[:, :, 1], axis=0)}
+
+
+def load_summary(wth_path, sta_name, climayears):
+    """
+    This function return the climatology summary of a station (see summarise), from
+    the store when the weather files did not change since it was calculated.
+    :param wth_path: the path of the wth file (where the weather data is.)
+    :param sta_name: the name of the station or point.
+    :param climayears: the climatological years array
+    :return the climatology summary
+    """
+    filenames = [wth_filename(wth_path, sta_name, year) for year in climayears]
+    summaryfile, metafile = summary_paths(sta_name, climayears)
+    stamp = source_stamp(filenames)
+
+    meta = None
+    if os.path.isfile(summaryfile) and os.path.isfile(metafile):
+        with open(metafile, 'r') as f:
+            meta = json.load(f)
+    if meta is not None and meta['climayears'] == [int(year) for year in climayears]:
+        if meta['stamp'] == stamp:
+            stats['hits'] += 1
+            return dict(np.load(summaryfile))
+        # the files were written again, check if the content really changed
+        digest = source_digest(filenames)
+        if meta['digest'] == digest:
+            meta['stamp'] = stamp
+            write_meta(metafile, meta)
+            stats['hits'] += 1
+            return dict(np.load(summaryfile))
+    else:
+        digest = source_digest(filenames)
+
+    stats['misses'] += 1
+    summary = summarise(read_wth_files(filenames))
+    if not os.path.isdir(STORE_PATH):
+        os.makedirs(STORE_PATH)
+    # write to a temporary file first so that a failed run never
+    # leaves a truncated summary behind
+    tmpfile = summaryfile + '.tmp.npz'
+    np.savez(tmpfile, **summary)
+    if os.path.exists(summaryfile):
+        os.remove(summaryfile)
+    os.rename(tmpfile, summaryfile)
+    write_meta(metafile, {'climayears': [int(year) for year in climayears], 'stamp': stamp, 'digest': digest})
+    return summary
+
+
+def write_meta(metafile, meta):
+    """
+    This function save the metadata describing the weather files
+    the summary was calculated from.
+    """
+    with open(metafile, 'w') as f:
+        json.dump(meta, f)
+    return None
@@ -11,6 +11,15 @@ leapinit = 1
 climatological_metric_file = "histmetric.txt"
 forecast_metric_file = "forecastmetric.txt"
 ensemble_metric_file = "ensemble.txt"
+ensemble_output_file = "ensemble_output.npz"
+plot_dpi = 300
+plot_format = "png"
+bootstrap_samples = 0
+bootstrap_level = 0.9
+results_db = "./data_output/results.sqlite"
+# the names of the first and last simulated year in the GLAM config file
+# (only used when the ensemble members simulate the forecast year only)
+glam_year_keys = ("ISYR", "IEYR")
 
 # The variables below are specifically set to init_year and init_year + 1
 # only for GLAM calculation since only need two years of data.
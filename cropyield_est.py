@@ -11,13 +11,23 @@
 import numpy as np
 import datetime as dt
 import os
-import glob
-import sys
+import time
 from shutil import copyfile
+from wthfile import wth_filename, write_wth, format_wth
+import glam_exec
+import glam_cache
+import glam_output
+import weighting
+import calcrisk
+import skill
+from prepare_driving import ensemble_views
+from ensem_glam_data_prep import ensemble_weather as glam_ensemble_weather
 
 
 def yieldforecast(datastartyear, dataendyear, climastartyear, climaendyear, forecastyear, forecastmonth, forecastday,
-                  wth_path, sta_name, lat, lon, glam_command, weights, climafile, forecastfile):
+                  wth_path, sta_name, lat, lon, glam_command, weights, climafile, forecastfile,
+                  ensemble_weather=None, processes=None, use_cache=True,
+                  outputfile=None, forecast_year_only=False):
     """
     This function is the function to extract data from climatological
     years add it to the forecast year and run the GLAM crop model to
@@ -39,16 +49,25 @@ def yieldforecast(datastartyear, dataendyear, climastartyear, climaendyear, fore
     :param lon: longitude of the location in degrees
     :param glam_command: the GLAM command line to run the model (as string)
     :param weights: tercile forecast probabilities of the weighting metric used
+    :param ensemble_weather: GLAM weather data of the ensemble members kept in memory
+                             (member x 365 x 5). When it is not given the member files
+                             prepared in ./ensemrun are used.
+    :param processes: if given, the ensemble members are run in parallel on this number of
+                      workers, each in its own working directory (see glam_exec.py).
+                      Otherwise they are run one after another in the current directory.
+    :param use_cache: if True the GLAM runs whose inputs (member weather, weather tree, soils,
+                      config and command line) are identical to a previous run are served from
+                      the GLAM results cache (see glam_cache.py)
+    :param outputfile: if given, the GLAM outputs of all the members (member x simulated year
+                       x output column) are saved in this binary file (see glam_output.py)
+    :param forecast_year_only: if True the ensemble members simulate only the forecast year
+                               (each in its own working directory) and the climatological
+                               yields come from a single GLAM run over the climatological
+                               years (see climatology_run). The GLAM config file must have
+                               the simulated years (glam_year_keys of config.py).
     
-    :return None 
+    :return a tuple (climatological yield, forecast yield of each member)
     """
-    path = wth_path 
-    # 1. remove the # created by python since the FORTRAN can not read it
-    filenames = glob.glob(path+'*.wth')
-    for filename in filenames:
-        filename = filename
-        replace_word(filename, '#', '')
-
     # 2.1 create a folder to put the ensemble crop yield files
     if not os.path.isdir("./output/ensem_output"):
         os.makedirs("./output/ensem_output")
@@ -88,28 +107,105 @@ def yieldforecast(datastartyear, dataendyear, climastartyear, climaendyear, fore
         copyfile(path + sta_name + '001001'+str(forecastyear)+'.wth',
                  path + 'origi_' + sta_name + '001001'+str(forecastyear)+'.wth')
     
-    for i in range(0, len(climayears)):
+    # the members simulate all the years or only the forecast year
+    simulated_years = None
+    if forecast_year_only:
+        simulated_years = (forecastyear, forecastyear)
 
-        # copy the prepared ensemble data from the ensemrun path
-        copyfile('.\ensemrun\ensrun_' + str(climayears[i]) + '.wth', path + sta_name + '001001' +  str(forecastyear)+'.wth')
-        
-        # prepare the forecast year weather data file in GLAM input file format
+    glam_exec.member_times.clear()
+    run_index = list(range(0, len(climayears)))
+    # the cache counters are running totals, the ones of this forecast are reported
+    cachestats = dict(glam_cache.stats)
+
+    # serve the members already run with identical inputs from the GLAM results cache
+    keys = {}
+    outputs = {}  # the parsed GLAM output of the members, each output file is parsed once
+    if use_cache:
+        shared = glam_cache.shared_digest(glam_command, wth_path, sta_name, forecastyear, simulated_years)
+        for i in list(run_index):
+            if ensemble_weather is not None:
+                member_text = format_wth(ensemble_weather[i], lat, lon)
+            else:
+                with open(glam_exec.normpath('.\ensemrun\ensrun_' + str(climayears[i]) + '.wth'), 'r') as f:
+                    member_text = f.read()
+            keys[i] = glam_cache.member_key(shared, member_text)
+            output = glam_cache.fetch(keys[i], ['./output/ensem_output/maize_'+str(climayears[i])+'.out',
+                                                './data_output/ensem_output/maize_'+str(climayears[i])+'.out'])
+            if output is not None:
+                outputs[i] = output
+                run_index.remove(i)
 
-        replace_word(path + sta_name + '001001' + str(forecastyear)+'.wth', '#', '')
+    if processes is not None or forecast_year_only:
+        # run the members in parallel, each in its own working directory
+        if ensemble_weather is not None:
+            members = [ensemble_weather[i] for i in run_index]
+        else:
+            members = [glam_exec.normpath('.\ensemrun\ensrun_' + str(climayears[i]) + '.wth') for i in run_index]
+        runoutputs = glam_exec.run_ensemble(glam_command, wth_path, sta_name, forecastyear, lat, lon,
+                                            [climayears[i] for i in run_index], members, processes or 1,
+                                            simulated_years)
+        for i, output in zip(run_index, runoutputs):
+            glam_exec.move_output(output, './output/ensem_output/maize_'+str(climayears[i])+'.out',
+                                  ['./data_output/ensem_output/maize_'+str(climayears[i])+'.out'])
+            if use_cache:
+                outputs[i] = glam_cache.store(keys[i], './output/ensem_output/maize_'+str(climayears[i])+'.out')
+        run_index = []
+
+    for i in run_index:
+        starttime = time.time()
+
+        if ensemble_weather is not None:
+            # write the ensemble member weather kept in memory directly as the forecast year file
+            forecastyeardata_prep(ensemble_weather[i], forecastyear, wth_path, sta_name, lat, lon)
+        else:
+            # copy the prepared ensemble data from the ensemrun path
+            copyfile('.\ensemrun\ensrun_' + str(climayears[i]) + '.wth', path + sta_name + '001001' +  str(forecastyear)+'.wth')
         
-        # run the GLAM crop model
-        command = glam_command
-        os.system(command)
+        # run the GLAM crop model (supervised, an error is raised if the run fails)
+        output = glam_exec.run_glam(glam_command)
+        glam_exec.member_times[climayears[i]] = time.time() - starttime
+
+        # move the model output file to the folders created on the first step
+        glam_exec.move_output(output, './output/ensem_output/maize_'+str(climayears[i])+'.out',
+                              ['./data_output/ensem_output/maize_'+str(climayears[i])+'.out'])
+
+        if use_cache:
+            outputs[i] = glam_cache.store(keys[i], './output/ensem_output/maize_'+str(climayears[i])+'.out')
 
-        # copy the model output file to the folder created on the first step
-        os.system('cp ./output/maize.out ./output/ensem_output/maize_'+str(climayears[i])+'.out')
+    if use_cache:
+        print "GLAM results cache: %s hits, %s misses" % (glam_cache.stats['hits'] - cachestats['hits'],
+                                                          glam_cache.stats['misses'] - cachestats['misses'])
 
-        # copy the model output file to the folder created on the first step
-        os.system('cp ./output/maize.out ./data_output/ensem_output/maize_'+str(climayears[i])+'.out')
+    # read the outputs of the members which are not parsed yet (reused or not cached)
+    # and put the outputs of all the members in one array (member x simulated year x column)
+    for i in range(0, len(climayears)):
+        if i not in outputs:
+            outputs[i] = glam_output.read_glam_output('./output/ensem_output/maize_'+str(climayears[i])+'.out')
+    ensemble = glam_output.stack_outputs([outputs[i] for i in range(0, len(climayears))])
+
+    if forecast_year_only:
+        # the climatology is simulated once (not by every member)
+        climatology = climatology_run(glam_command, wth_path, sta_name, forecastyear, lat, lon, climayears, use_cache)
+        climayield = climatology[:len(climayears), glam_output.YIELD_COLUMN]
+        index = 0  # the members simulated the forecast year only
+    elif climayears[0] <= forecastyear <= climayears[-1]:
+        # the members simulated the forecast year with their own weather, so the
+        # climatology comes from a run with the actual weather of all the years
+        climatology = climatology_run(glam_command, wth_path, sta_name, forecastyear, lat, lon, climayears,
+                                      use_cache, all_years=True)
+        climayield = climatology[:len(climayears), glam_output.YIELD_COLUMN]
+        years = np.arange(climastartyear, dataendyear+1)
+        index = sorted(years).index(forecastyear)  # the index of the forecastyear to extract obs. yield from file
+    else:
+        climatology = None
+        climayield = ensemble[0, :len(climayears), glam_output.YIELD_COLUMN]
+        years = np.arange(climastartyear, dataendyear+1)
+        index = sorted(years).index(forecastyear)  # the index of the forecastyear to extract obs. yield from file
+    if outputfile is not None:
+        glam_output.save_ensemble_output(outputfile, climayears, ensemble, climatology)
 
     # prepare the text files containing tamsat alert inputs
     # save the climatological time series
-    climayield = np.genfromtxt('./output/ensem_output/maize_' + str(climayears[0])+'.out')[:len(climayears), 7]
     clima_ts = np.array([climayears, climayield])
     clima_ts = clima_ts.T
     np.savetxt(climafile, clima_ts, delimiter='   ', header='ClimaYears    MetricValue',
@@ -117,76 +213,213 @@ def yieldforecast(datastartyear, dataendyear, climastartyear, climaendyear, fore
 
     # yield data of forecast year based on all climatological year
     # weather data --> save the forecast ensemble time series
-    years = np.arange(climastartyear, dataendyear+1)
-    index = sorted(years).index(forecastyear)  # the index of the forecastyear to extract obs. yield from file
-
-    forcayearyield = []
-    for m in range(0, len(climayears)):
-        filename = './data_output/ensem_output/maize_'+str(climayears[m])+'.out'
-        x = np.genfromtxt(filename)[index, 7]  # yield data of forecast year
-        forcayearyield = np.append(forcayearyield, x)
+    forcayearyield = ensemble[:, index, glam_output.YIELD_COLUMN]  # yield data of forecast year
     foreca_ts = np.array([climayears, forcayearyield])
     foreca_ts = foreca_ts.T
     np.savetxt(forecastfile, foreca_ts, delimiter='   ', header='ClimaYears    MetricValue',
                fmt='%i    %0.2f')
-    return None
+    return climayield, forcayearyield
 
 
-def forecastyeardata_prep(forecayeardata, forecastyear, wth_path, sta_name, lat,lon):
+def climatology_run(glam_command, wth_path, sta_name, forecastyear, lat, lon, climayears, use_cache=True,
+                    all_years=False):
     """
-    This function will prepare the forecast year weather data
-    file in the format required by GLAM input file format.
+    This function run GLAM once over the climatological years with their actual
+    weather (in its own working directory). The run only depends on the weather of
+    the climatological years so it is served from the GLAM results cache for all
+    the forecasts made with the same climatology period.
+    :param glam_command: the GLAM command line to run the model (as string)
+    :param wth_path: the file path where the .wth files are present (as string)
+    :param sta_name: name of station or location
+    :param forecastyear: the forecast year
+    :param lat: latitude of the location in degrees
+    :param lon: longitude of the location in degrees
+    :param climayears: the climatological years array
+    :param use_cache: if True the run is served from the GLAM results cache when possible
+    :param all_years: if True the run simulates all the years of the GLAM config file
+                      (the climatological years are not set in the config file)
+    :return the GLAM output (climatological year x output column)
     """
-    # extract each year data and save it according to GLAM format
-    year = np.arange(forecastyear, forecastyear+1)
-    path = wth_path 
-    for i in range(0, 1):
-        indata = forecayeardata[:, :]
-        
-        # prepare the date in the GLAM format (yyddd)
-        ddd = [format(item, "03d") for item in xrange(1, (len(forecayeardata)+1))]
-        yy_tmp = map(int, str(year[int(i/365)]))
-        
-        yy = int(''.join(str(b) for b in yy_tmp[-2:]))
-        yy = format(yy, "02d")
-        
-        date = []
-        for v in range(0, len(ddd)):
-            dateval = str(yy) + ddd[v]
-            newdate = int(dateval)
-            date = np.append(date, newdate)
-    
-        indata[:, 0] = date
-        
-        headval = '*WEATHER : Example weather file\n\
-@INS   LAT  LONG  ELEV   TAV   AMP REFHT WNDHT\n\
-ITHY %s  %s\n\
-@DATE   SRAD   TMAX   TMIN   RAIN ' % (lat, lon)
-        np.savetxt(path + sta_name + '001001' +  str(year[int(i/365)])+'.wth',
-                   indata, header=headval, delimiter='', fmt='%05d%6.2f%6.2f%6.2f%6.2f')
-        del indata
-        del date
-        return None
-
-
-def replace_word(infile, old_word, new_word):
+    outfile = './output/ensem_output/maize_climatology.out'
+    simulated_years = (climayears[0], climayears[-1])
+    if all_years:
+        simulated_years = None
+
+    # the actual weather of the forecast year is kept in the origi_ copy
+    member_weather = None
+    if climayears[0] <= forecastyear <= climayears[-1]:
+        member_weather = glam_exec.normpath(wth_filename(wth_path, 'origi_' + sta_name, forecastyear))
+
+    if use_cache:
+        shared = glam_cache.shared_digest(glam_command, wth_path, sta_name, forecastyear, simulated_years)
+        member_text = ''
+        if member_weather is not None:
+            with open(member_weather, 'r') as f:
+                member_text = f.read()
+        key = glam_cache.member_key(shared, member_text)
+        output = glam_cache.fetch(key, [outfile])
+        if output is not None:
+            return output
+
+    output = glam_exec.run_ensemble(glam_command, wth_path, sta_name, forecastyear, lat, lon, ['climatology'],
+                                    [member_weather], 1, simulated_years)[0]
+    glam_exec.move_output(output, outfile)
+    if use_cache:
+        return glam_cache.store(key, outfile)
+    return glam_output.read_glam_output(outfile)
+
+
+def hindcast(datastartyear, dataendyear, climastartyear, climaendyear, hindyears, initdates, wth_path, sta_name,
+             lat, lon, glam_command, weights, stat, weight_var, wf_year, wf_month, wf_day, w_leadtime,
+             leapinit, leaparray, nonleaparray, processes=None, use_cache=True,
+             hindcast_path='./data_output/hindcast/', forecast_year_only=False):
+    """
+    This function run the yield forecast for many forecast years and forecast dates
+    (hindcast) in one job and verify the risk probabilities of the five yield categories
+    against the yield simulated with the actual weather of each forecast year.
+    The GLAM weather files of all the years (and the soils file) must be prepared in
+    wth_path before (they are shared by all the forecasts). The GLAM runs with inputs
+    identical to a previous run (e.g. the reference run of a year for the different
+    forecast dates, or a hindcast run again) are served from the GLAM results cache.
+
+    :param datastartyear: the year the data set start
+    :param dataendyear: the the year the data set end
+    :param climastartyear: the year climatology value start.
+    :param climaendyear: the year climatology value end.
+    :param hindyears: the forecast years of the hindcast
+    :param initdates: the forecast dates of each year as a list of (month, day)
+    :param wth_path: the file path where the .wth files are present (as string)
+    :param sta_name: name of station or location
+    :param lat: latitude of the location in degrees
+    :param lon: longitude of the location in degrees
+    :param glam_command: the GLAM command line to run the model (as string)
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param stat: statistical method to be used for probability distribution comparison (ecdf or normal)
+    :param weight_var: the weighting variable used (0=rainfall, 1=temperature)
+    :param wf_year: just one year to calculate days (leave it default)
+    :param wf_month: the month from which we calculate the weighting metric
+    :param wf_day: the day from which the weighting metric is calculated
+    :param w_leadtime: the number of days from the wf_day the weighting metric will be assumed
+    :param leapinit: 1 to retain leap years in the initialization step; 0 to not retain leap years
+    :param leaparray: the forcing data including leap years
+    :param nonleaparray: the forcing data not including leap years
+    :param processes: if given, the ensemble members are run in parallel on this number of workers
+    :param use_cache: if True the GLAM runs are served from the GLAM results cache when possible
+    :param hindcast_path: the folder of the hindcast outputs (metric files of each forecast,
+                          hindcast.npz archive and skill.txt)
+    :param forecast_year_only: if True the ensemble members simulate only the forecast year
+                               (see yieldforecast)
+
+    :return a dictionary with the forecast year, month, day, the probabilities of the categories
+            (case x category), the observed yield and category of each case and the climatological,
+            forecast and weighting metric of each case
     """
-    This function helps to replace some characters not readable by the FORTRAN
-    code in the GLAM input files
+    if not os.path.isdir(hindcast_path):
+        os.makedirs(hindcast_path)
+
+    cases = [(year, month, day) for year in hindyears for month, day in initdates]
+    for year, month, day in cases:
+        if year < climastartyear or year > dataendyear:
+            raise ValueError('The hindcast year %s is not between the climatology start year %s and '
+                             'the data end year %s.' % (year, climastartyear, dataendyear))
+
+    observed = np.empty(len(cases))
+    climametrics = []
+    forecametrics = []
+    wmetrics = []
+    references = {}  # the reference run (actual weather) of each year
+    for c in range(0, len(cases)):
+        year, month, day = cases[c]
+        f_date = dt.datetime(year, month, day).date().strftime('%d-%b-%Y')
+        tag = sta_name + '_' + dt.datetime(year, month, day).date().strftime('%Y%m%d')
+        print "Hindcast %s of %s: %s" % (c + 1, len(cases), f_date)
+
+        # the weather of the ensemble members kept in memory
+        ensemble = ensemble_views(year, month, day, year, 1, 1, year + 1, 12, 31, datastartyear,
+                                  climastartyear, climaendyear, leapinit, leaparray, nonleaparray)[:2]
+        members = glam_ensemble_weather(ensemble, year)
+        climametric, forecametric = yieldforecast(datastartyear, dataendyear, climastartyear, climaendyear, year,
+                                                  month, day, wth_path, sta_name, lat, lon, glam_command, weights,
+                                                  hindcast_path + 'histmetric_' + tag + '.txt',
+                                                  hindcast_path + 'ensemble_' + tag + '.txt',
+                                                  ensemble_weather=members, processes=processes,
+                                                  use_cache=use_cache, forecast_year_only=forecast_year_only)
+
+        # put back the actual weather of the forecast year for the next runs
+        forecastfile = wth_filename(wth_path, sta_name, year)
+        copyfile(wth_filename(wth_path, 'origi_' + sta_name, year), forecastfile)
+        os.remove(wth_filename(wth_path, 'origi_' + sta_name, year))
+
+        # the yield of the forecast year simulated with its actual weather
+        index = year - climastartyear
+        if year not in references:
+            references[year] = reference_run(glam_command, wth_path, sta_name, year, use_cache)
+        observed[c] = references[year][index, glam_output.YIELD_COLUMN]
 
-    :param infile: the file input where we want the characters to be changed.
-    :param old_word: the old character to be changed.
-    :param new_word: the new character to be changed with.
+        climayears = np.arange(climastartyear, climastartyear + len(climametric))
+        wmetric = weighting.weight_metric_prep(climayears, wth_path, sta_name, f_date, weight_var, wf_year,
+                                               wf_month, wf_day, w_leadtime,
+                                               hindcast_path + 'forecastmetric_' + tag + '.txt')
+        climametrics.append(climametric)
+        forecametrics.append(forecametric)
+        wmetrics.append(wmetric)
 
-    :return None 
+    # the risk of all the forecasts and their verification at once
+    climametrics = np.array(climametrics)
+    probs = calcrisk.batch_risk(climametrics, forecametrics, wmetrics, weights, stat)[1]
+    bounds = skill.category_bounds(climametrics, stat)
+    category = skill.observed_category(observed, bounds)
+    skill.save_skill(hindcast_path + 'skill.txt', probs, category)
+    relprob, relfreq, relcount = skill.reliability(probs, category)
+
+    cases = np.array(cases, dtype=int)
+    result = {'year': cases[:, 0], 'month': cases[:, 1], 'day': cases[:, 2], 'probabilities': probs,
+              'observed': observed, 'category': category}
+    np.savez(hindcast_path + 'hindcast.npz', climametric=climametrics, forecametric=np.array(forecametrics),
+             bounds=bounds, reliability_probability=relprob, reliability_frequency=relfreq,
+             reliability_count=relcount, wmetric=np.array(wmetrics), **result)
+    result.update({'climametric': climametrics, 'forecametric': np.array(forecametrics),
+                   'wmetric': np.array(wmetrics)})
+    return result
+
+
+def reference_run(glam_command, wth_path, sta_name, forecastyear, use_cache=True):
     """
-    if not os.path.isfile(infile):
-        print ("Error on replace_word, not a regular file: "+infile)
-        sys.exit(1)
-    f1=open(infile, 'r').read()
-    f2=open(infile, 'w')
-    m=f1.replace(old_word, new_word)
-    f2.write(m)
-    return None
+    This function run GLAM with the actual weather of the forecast year (reference
+    run used as the observation of the hindcast).
+    :param glam_command: the GLAM command line to run the model (as string)
+    :param wth_path: the file path where the .wth files are present (as string)
+    :param sta_name: name of station or location
+    :param forecastyear: the forecast year
+    :param use_cache: if True the run is served from the GLAM results cache when possible
+    :return the GLAM output (simulated year x output column)
+    """
+    if not os.path.isdir("./output/hindcast"):
+        os.makedirs("./output/hindcast")
+    outfile = './output/hindcast/maize_reference_' + str(forecastyear) + '.out'
 
+    if use_cache:
+        shared = glam_cache.shared_digest(glam_command, wth_path, sta_name, forecastyear)
+        with open(wth_filename(wth_path, sta_name, forecastyear), 'r') as f:
+            key = glam_cache.member_key(shared, f.read())
+        output = glam_cache.fetch(key, [outfile])
+        if output is not None:
+            return output
 
+    glam_exec.move_output(glam_exec.run_glam(glam_command), outfile)
+    if use_cache:
+        return glam_cache.store(key, outfile)
+    return glam_output.read_glam_output(outfile)
+
+
+def forecastyeardata_prep(forecayeardata, forecastyear, wth_path, sta_name, lat,lon):
+    """
+    This function will prepare the forecast year weather data
+    file in the format required by GLAM input file format.
+    """
+    # prepare the date in the GLAM format (yyddd) of the forecast year
+    indata = np.array(forecayeardata, dtype=float)
+    indata[:, 0] = (forecastyear % 100) * 1000 + np.arange(1, len(indata) + 1)
+    write_wth(wth_filename(wth_path, sta_name, forecastyear), indata, lat, lon)
+    del indata
+    return None
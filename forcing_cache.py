@@ -0,0 +1,175 @@
+# =============================================================#
+# Binary cache of the parsed JULES forcing file
+# ============================================================#
+# This module is used to parse the long term JULES forcing
+# text file only once. The parsed array is saved next to the
+# text file as a .npy file which is memory mapped by every
+# data preparation stage. The cache is rebuilt when the size,
+# modification time and content hash of the text file no longer
+# match the values recorded when the cache was written.
+# A lightweight index of the file (number of rows and columns)
+# is also kept next to it (forcing_index) so the data coverage
+# of a run can be checked before any data preparation.
+# ==============================================================#
+import numpy as np
+import os
+import json
+import hashlib
+import datetime as dt
+
+CACHE_SUFFIX = '.cache.npy'
+META_SUFFIX = '.cache.json'
+INDEX_SUFFIX = '.index.json'
+
+
+def file_digest(filename, blocksize=1 << 20):
+    """
+    This function calculate the sha1 hash of the content of a file.
+
+    :param filename: the file to hash
+    :param blocksize: number of bytes read at a time
+    :return the hex digest of the file content
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            sha.update(block)
+            block = f.read(blocksize)
+    return sha.hexdigest()
+
+
+def cache_paths(filename):
+    """
+    This function return the names of the binary cache and of its
+    metadata file for a given forcing file.
+    """
+    return filename + CACHE_SUFFIX, filename + META_SUFFIX
+
+
+def load_forcing(filename, mmap_mode='r'):
+    """
+    This function return the parsed content of the JULES forcing file.
+    The text file is parsed with genfromtxt only when the cache is missing
+    or stale, otherwise the binary cache is memory mapped.
+
+    :param filename: the file containing the long term weather data in the
+                    format of JULES forcing file
+    :param mmap_mode: memory map mode of the returned array (None loads it in memory)
+    :return the forcing data array (days x variables)
+    """
+    cachefile, metafile = cache_paths(filename)
+    stat = os.stat(filename)
+
+    meta = None
+    if os.path.isfile(cachefile) and os.path.isfile(metafile):
+        with open(metafile, 'r') as f:
+            meta = json.load(f)
+
+    if meta is not None and meta['size'] == stat.st_size:
+        if meta['mtime'] == stat.st_mtime:
+            return np.load(cachefile, mmap_mode=mmap_mode)
+        # the file was touched, check if the content really changed
+        digest = file_digest(filename)
+        if meta['digest'] == digest:
+            meta['mtime'] = stat.st_mtime
+            write_meta(metafile, meta)
+            return np.load(cachefile, mmap_mode=mmap_mode)
+    else:
+        digest = file_digest(filename)
+
+    data = np.genfromtxt(filename)
+    # write to a temporary file first so that a failed run never
+    # leaves a truncated cache behind
+    tmpfile = cachefile + '.tmp.npy'
+    np.save(tmpfile, data)
+    if os.path.exists(cachefile):
+        os.remove(cachefile)
+    os.rename(tmpfile, cachefile)
+    write_meta(metafile, {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': digest})
+    del data
+    return np.load(cachefile, mmap_mode=mmap_mode)
+
+
+def write_meta(metafile, meta):
+    """
+    This function save the metadata describing the forcing file
+    the cache was built from.
+    """
+    with open(metafile, 'w') as f:
+        json.dump(meta, f)
+    return None
+
+
+def forcing_index(filename):
+    """
+    This function return the index of the JULES forcing file: its number of data rows
+    (days) and of columns (variables). The values are taken from the binary cache when
+    it is up to date, otherwise the rows are counted without parsing the values. The
+    index is saved next to the file and used while its size and modification time
+    are unchanged.
+
+    :param filename: the file containing the long term weather data in the
+                    format of JULES forcing file
+    :return a dictionary with the size, mtime, rows and columns of the file
+            (columns is the smallest number of columns of the first and last row)
+    """
+    indexfile = filename + INDEX_SUFFIX
+    stat = os.stat(filename)
+    if os.path.isfile(indexfile):
+        with open(indexfile, 'r') as f:
+            index = json.load(f)
+        if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime:
+            return index
+
+    cachefile, metafile = cache_paths(filename)
+    meta = None
+    if os.path.isfile(cachefile) and os.path.isfile(metafile):
+        with open(metafile, 'r') as f:
+            meta = json.load(f)
+    if meta is not None and meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime:
+        shape = np.load(cachefile, mmap_mode='r').shape
+        rows, columns = shape[0], (shape[1] if len(shape) > 1 else 1)
+    else:
+        # the rows genfromtxt would read (not empty and not comments)
+        rows = 0
+        first = last = ''
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    if not rows:
+                        first = line
+                    last = line
+                    rows += 1
+        columns = min(len(first.split()), len(last.split()))
+
+    index = {'size': stat.st_size, 'mtime': stat.st_mtime, 'rows': rows, 'columns': columns}
+    write_meta(indexfile, index)
+    return index
+
+
+def forcing_coverage(rows, datastartyear, leapremoved):
+    """
+    This function return the period covered by a daily forcing file starting on the
+    1st of January of datastartyear.
+
+    :param rows: the number of days (rows) of the file
+    :param datastartyear: the year at the start of the data
+    :param leapremoved: 0 if the file contains the leap days (29th February), 1 if they were removed
+    :return a dictionary with the last date of the data (last), the number of days without
+            the leap days (noleap_days) and the last complete year (last_complete_year)
+    """
+    if leapremoved == 0:
+        last = dt.date(datastartyear, 1, 1) + dt.timedelta(days=rows - 1)
+        leapdays = sum(1 for year in range(datastartyear, last.year + 1)
+                       if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) and dt.date(year, 2, 29) <= last)
+        noleap_days = rows - leapdays
+    else:
+        # 365 days in every year, the 28th February is followed by the 1st March
+        noleap_days = rows
+        year = datastartyear + (rows - 1) // 365
+        last = dt.date(1973, 1, 1) + dt.timedelta(days=(rows - 1) % 365)  # 1973 is not a leap year
+        last = dt.date(year, last.month, last.day)
+    last_complete_year = last.year if (last.month, last.day) == (12, 31) else last.year - 1
+    return {'last': last, 'noleap_days': noleap_days, 'last_complete_year': last_complete_year}
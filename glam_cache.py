@@ -0,0 +1,144 @@
+# =============================================================#
+# Content addressed cache of the GLAM run results
+# ============================================================#
+# A GLAM run is fully defined by its command line (including
+# the SET parameter), the executable and config files and the
+# files in the weather tree (weather files of every year, soils
+# file). This module key each run with the sha1 hash of all
+# these inputs and keep the GLAM output (raw maize.out text and
+# parsed array) of each key under CACHE_PATH, so a run with the
+# same inputs is served from the cache instead of running GLAM.
+# The least recently used entries are removed when the cache is
+# larger than cache_max_bytes.
+# ==============================================================#
+import numpy as np
+import os
+import hashlib
+from shutil import copyfile
+from forcing_cache import file_digest
+from glam_exec import normpath, link_or_copy
+from wthfile import wth_filename
+from glam_output import read_glam_output
+
+CACHE_PATH = './glam_cache/'
+cache_max_bytes = 512 * 1024 * 1024
+
+# number of GLAM runs served from the cache (hits) and run with GLAM (misses),
+# running totals of the process (yieldforecast reports the ones of each forecast)
+stats = {'hits': 0, 'misses': 0}
+
+
+def shared_digest(glam_command, wth_path, sta_name, forecastyear, simulated_years=None):
+    """
+    This function calculate the hash of the GLAM inputs shared by all the
+    ensemble members: the command line, the files named on the command
+    line and all the files in the weather tree except the forecast year
+    weather file (which is the member weather) and the copy of the observed
+    forecast year weather kept by the yield forecast (origi_*, not read by GLAM).
+    :param glam_command: the GLAM command line to run the model (as string)
+    :param wth_path: the file path where the .wth files are present (as string)
+    :param sta_name: name of station or location
+    :param forecastyear: the year for which we are going to forecast yield
+    :param simulated_years: if given (first year, last year), the runs simulate only these
+                            years and only the weather files of these years are hashed
+    :return the hex digest of the shared inputs
+    """
+    sha = hashlib.sha1()
+    sha.update(glam_command.encode('utf-8'))
+    if simulated_years is not None:
+        sha.update(('years %s %s' % tuple(simulated_years)).encode('utf-8'))
+    for token in glam_command.split():
+        if os.path.isfile(normpath(token)):
+            sha.update((token + file_digest(normpath(token))).encode('utf-8'))
+
+    # the weather tree (weather, soils and config files below the top folder of wth_path)
+    wth_dir = normpath(wth_path)
+    top = wth_dir.split(os.sep)[0]
+    if os.path.isabs(wth_dir) or top in ('', '.', '..'):
+        top = wth_dir
+    forecastfile = os.path.normpath(wth_filename(wth_dir + os.sep, sta_name, forecastyear))
+    if simulated_years is not None:
+        wanted = [os.path.normpath(wth_filename(wth_dir + os.sep, sta_name, year))
+                  for year in range(simulated_years[0], simulated_years[1] + 1)]
+    names = []
+    for root, dirs, files in os.walk(top):
+        for name in files:
+            name = os.path.normpath(os.path.join(root, name))
+            if simulated_years is None or not name.endswith('.wth') or name in wanted:
+                names.append(name)
+    for name in sorted(names):
+        if name != forecastfile and not os.path.basename(name).startswith('origi_'):
+            sha.update((name + file_digest(name)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def member_key(shared, member_text):
+    """
+    This function return the cache key of the GLAM run of an ensemble member.
+    :param shared: the digest of the shared inputs (see shared_digest)
+    :param member_text: the content of the forecast year weather file of the member
+    """
+    sha = hashlib.sha1(shared.encode('utf-8'))
+    sha.update(member_text.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def fetch(key, outfiles):
+    """
+    This function copy the cached GLAM output of a key to the output files.
+    :param key: the cache key of the run
+    :param outfiles: list of the output files to restore
+    :return the parsed GLAM output array, None if the key is not in the cache
+    """
+    rawfile = CACHE_PATH + key + '.out'
+    arrayfile = CACHE_PATH + key + '.npy'
+    if not (os.path.isfile(rawfile) and os.path.isfile(arrayfile)):
+        stats['misses'] += 1
+        return None
+    stats['hits'] += 1
+    # mark the entry as recently used
+    os.utime(rawfile, None)
+    os.utime(arrayfile, None)
+    copyfile(rawfile, outfiles[0])
+    for outfile in outfiles[1:]:
+        link_or_copy(outfiles[0], outfile)
+    return np.load(arrayfile)
+
+
+def store(key, outfile):
+    """
+    This function add the output of a GLAM run to the cache.
+    :param key: the cache key of the run
+    :param outfile: the GLAM output file (maize.out) of the run
+    :return the parsed GLAM output array
+    """
+    if not os.path.isdir(CACHE_PATH):
+        os.makedirs(CACHE_PATH)
+    output = read_glam_output(outfile)
+    np.save(CACHE_PATH + key + '.npy', output)
+    copyfile(outfile, CACHE_PATH + key + '.out')
+    evict()
+    return output
+
+
+def evict():
+    """
+    This function remove the least recently used entries until the cache
+    is not larger than cache_max_bytes.
+    """
+    # the raw and parsed files of a key are removed together
+    entries = {}
+    for name in os.listdir(CACHE_PATH):
+        filename = os.path.join(CACHE_PATH, name)
+        stat = os.stat(filename)
+        key = os.path.splitext(name)[0]
+        mtime, size, filenames = entries.get(key, (0, 0, []))
+        entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size, filenames + [filename])
+    total = sum(entry[1] for entry in entries.values())
+    for mtime, size, filenames in sorted(entries.values()):
+        if total <= cache_max_bytes:
+            break
+        for filename in filenames:
+            os.remove(filename)
+        total -= size
+    return None
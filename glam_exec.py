@@ -0,0 +1,357 @@
+# =============================================================#
+# Parallel execution of the GLAM ensemble members
+# ============================================================#
+# GLAM reads its weather files from wth_path and always writes
+# ./output/maize.out, so two runs can not share a directory.
+# This module gives each ensemble member its own working
+# directory under SCRATCH_PATH which mirrors the files GLAM
+# needs (executable, config, weather and soil files) with the
+# forecast year weather file replaced by the member weather,
+# and runs the members on a bounded pool of workers.
+# Every GLAM run goes through run_glam which runs GLAM without a
+# shell, with a timeout, checks the exit code and the output
+# file, and retries the failed runs before raising an error.
+# A member can also be staged to simulate only some years (e.g.
+# the forecast year): only the weather files of these years are
+# staged and the years are set in its copy of the config file.
+# ==============================================================#
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from wthfile import wth_filename, write_wth
+
+SCRATCH_PATH = './scratch/'
+GLAM_OUTPUT = 'output/maize.out'
+GLAM_LOG = 'output/glam.log'
+
+# the names of the first and last simulated year in the GLAM config file
+# (set from glam_year_keys of config.py by calc_cropyield_wrapper)
+config_year_keys = ('ISYR', 'IEYR')
+
+# time limit (seconds) of a single GLAM run and number of times
+# a failed or timed out run is tried again
+glam_timeout = 1800
+glam_retries = 1
+
+# wall time (seconds) of the GLAM run (staging included) of each ensemble
+# member of the last yield forecast, by climatological year
+member_times = {}
+
+
+def normpath(path):
+    """
+    This function convert the paths of the ReadVar.py settings (which can
+    be written with '\\' separators) to the separator of the system.
+    """
+    return os.path.normpath(path.replace('\\', os.sep).replace('/', os.sep))
+
+
+def link_or_copy(src, dst):
+    """
+    This function stage a file with a hard link, or with a copy when
+    hard links are not possible (other file system, Windows python 2).
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except (AttributeError, OSError):
+        shutil.copyfile(src, dst)
+    return None
+
+
+def move_output(src, dst, links=()):
+    """
+    This function move a GLAM output file to dst with a rename and make the
+    other copies (links) as hard links of dst when possible.
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.rename(src, dst)
+    except OSError:
+        shutil.move(src, dst)
+    for link in links:
+        link_or_copy(dst, link)
+    return None
+
+
+def glam_args(glam_command):
+    """
+    This function split the GLAM command line in the arguments of the process
+    (no shell is used). The paths are converted to the separator of the system.
+    """
+    args = []
+    for token in glam_command.split():
+        if '\\' in token or '/' in token:
+            token = normpath(token)
+        args.append(token)
+    # the executable is looked up from the working directory, not in the PATH
+    if not os.path.isabs(args[0]) and os.path.dirname(args[0]) == '':
+        args[0] = os.path.join(os.curdir, args[0])
+    return args
+
+
+def kill_timed_out(proc, timedout):
+    """
+    This function kill a GLAM run which is still running when its time limit is
+    reached (the timer can fire after the process exited but before it is cancelled).
+    :param proc: the GLAM process
+    :param timedout: list the time out is recorded in
+    :return None
+    """
+    if proc.poll() is None:
+        try:
+            proc.kill()
+            timedout.append(True)
+        except OSError:
+            # the process exited in the meantime
+            pass
+    return None
+
+
+def run_glam(glam_command, cwd=os.curdir, timeout=None, retries=None):
+    """
+    This function run GLAM in the working directory cwd under supervision.
+    The process is started without a shell and killed when it runs longer
+    than timeout. Its stdout and stderr are saved in output/glam.log. A run
+    which fails (exit code, time out or no output file) is tried again up
+    to retries times before an error is raised.
+    :param glam_command: the GLAM command line to run the model (as string)
+    :param cwd: the working directory of the run
+    :param timeout: time limit of the run in seconds (default glam_timeout)
+    :param retries: number of times a failed run is tried again (default glam_retries)
+    :return the name of the GLAM output file (maize.out) of the run
+    """
+    if timeout is None:
+        timeout = glam_timeout
+    if retries is None:
+        retries = glam_retries
+    args = glam_args(glam_command)
+    output = os.path.join(cwd, GLAM_OUTPUT)
+
+    for attempt in range(0, retries + 1):
+        # never read the output of an earlier run
+        if os.path.exists(output):
+            os.remove(output)
+
+        proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timedout = []
+        timer = threading.Timer(timeout, kill_timed_out, [proc, timedout])
+        timer.start()
+        try:
+            stdout, stderr = proc.communicate()
+        finally:
+            timer.cancel()
+
+        if os.path.isdir(os.path.dirname(os.path.join(cwd, GLAM_LOG))):
+            with open(os.path.join(cwd, GLAM_LOG), 'wb') as f:
+                f.write(stdout + stderr)
+
+        if timedout:
+            reason = 'timed out after %s seconds' % timeout
+        elif proc.returncode != 0:
+            reason = 'exit code %s' % proc.returncode
+        elif not os.path.isfile(output) or os.path.getsize(output) == 0:
+            reason = 'no output file %s' % output
+        else:
+            return output
+        print "WARNING: GLAM run in %s failed (%s), attempt %s of %s" % (cwd, reason, attempt + 1, retries + 1)
+
+    raise RuntimeError('GLAM run in %s failed (%s): %s\n%s' % (cwd, reason, ' '.join(args),
+                                                              stderr.decode('utf-8', 'replace')[-2000:]))
+
+
+def mirror_tree(src, dst, skip=()):
+    """
+    This function create the directory tree src in dst with real directories
+    and linked files. The files in skip (names relative to src) are left out.
+    """
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        target = os.path.normpath(os.path.join(dst, rel))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in files:
+            if os.path.normpath(os.path.join(rel, name)) in skip:
+                continue
+            link_or_copy(os.path.join(root, name), os.path.join(target, name))
+    return None
+
+
+def config_year_pattern(key):
+    """
+    This function return the pattern of the line of a simulated year in a GLAM config file.
+    """
+    return re.compile(r'^(\s*' + re.escape(key) + r'[\s=]+)\S+', re.MULTILINE)
+
+
+def set_config_years(text, startyear, endyear):
+    """
+    This function set the first and last simulated year in the text of a GLAM
+    config file (lines starting with the names in config_year_keys).
+    :return the new text of the config file
+    """
+    for key, year in zip(config_year_keys, (startyear, endyear)):
+        pattern = config_year_pattern(key)
+        if not pattern.search(text):
+            raise ValueError('The simulated year %s is not in the GLAM config file, only some years can '
+                             'be simulated if the config file has the lines %s (glam_year_keys of config.py).'
+                             % (key, ' '.join(config_year_keys)))
+        text = pattern.sub(lambda match: match.group(1) + str(year), text)
+    return text
+
+
+def check_config_years(glam_command):
+    """
+    This function check that the config file(s) of the GLAM command line have the
+    lines of the simulated years, before the ensemble members are prepared.
+    :param glam_command: the GLAM command line (executable and config file)
+    :return None
+    """
+    for token in [normpath(token) for token in glam_command.split()][1:]:
+        if os.path.isfile(token):
+            with open(token, 'r') as f:
+                text = f.read()
+            for key in config_year_keys:
+                if not config_year_pattern(key).search(text):
+                    raise ValueError('The simulated year %s is not in the GLAM config file %s, only some years '
+                                     'can be simulated if the config file has the lines %s (glam_year_keys of '
+                                     'config.py).' % (key, token, ' '.join(config_year_keys)))
+    return None
+
+
+def stage_member(member_dir, glam_command, wth_path, sta_name, forecastyear, lat, lon, member_weather,
+                 simulated_years=None):
+    """
+    This function prepare the isolated working directory of an ensemble member.
+    :param member_dir: the working directory of the member (removed first if it exists)
+    :param glam_command: the GLAM command line (executable and config file relative to
+                         the current directory)
+    :param wth_path: the path of the wth files relative to the current directory
+    :param sta_name: name of station or location
+    :param forecastyear: the year for which we are going to forecast yield
+    :param lat: latitude of the location in degrees
+    :param lon: longitude of the location in degrees
+    :param member_weather: the GLAM weather data of the member (day x 5) or the name
+                           of the .wth file of the member (None to keep the weather file
+                           of the forecast year)
+    :param simulated_years: if given (first year, last year), only the weather files of
+                            these years are staged and the years are set in the config
+                            file(s) of the member (see set_config_years)
+    :return None
+    """
+    if os.path.isdir(member_dir):
+        shutil.rmtree(member_dir)
+    os.makedirs(member_dir)
+
+    # the tree holding the weather files (and the config, soils files) is mirrored,
+    # the forecast year weather file is replaced with the member weather
+    wth_dir = normpath(wth_path)
+    top = wth_dir.split(os.sep)[0]
+    if os.path.isabs(wth_dir) or top in ('', '.', '..'):
+        raise ValueError('wth_path must be a folder below the working directory to run the '
+                         'ensemble members in separate directories: ' + wth_path)
+    forecastfile = os.path.relpath(wth_filename(wth_dir + os.sep, sta_name, forecastyear), top)
+    tokens = [normpath(token) for token in glam_command.split()]
+    configs = [os.path.relpath(token, top) for token in tokens[1:]
+               if os.path.isfile(token) and token.split(os.sep)[0] == top]
+    skip = configs
+    if member_weather is not None:
+        skip = skip + [forecastfile]
+    if simulated_years is not None:
+        # the weather files of the years which are not simulated
+        wanted = [os.path.basename(wth_filename('', sta_name, year))
+                  for year in range(simulated_years[0], simulated_years[1] + 1)]
+        skip = skip + [os.path.relpath(os.path.join(wth_dir, name), top) for name in os.listdir(wth_dir)
+                       if name.endswith('.wth') and name not in wanted]
+    mirror_tree(top, os.path.join(member_dir, top), skip=skip)
+
+    member_wth = wth_filename(os.path.join(member_dir, wth_dir) + os.sep, sta_name, forecastyear)
+    if isinstance(member_weather, str):
+        link_or_copy(member_weather, member_wth)
+    elif member_weather is not None:
+        write_wth(member_wth, member_weather, lat, lon)
+
+    # each member has its own copy of the config file(s)
+    for config in configs:
+        shutil.copyfile(os.path.join(top, config), os.path.join(member_dir, top, config))
+
+    # the GLAM executable and other files of the command line outside the tree
+    for token in tokens:
+        if os.path.isfile(token) and token.split(os.sep)[0] != top:
+            target = os.path.join(member_dir, token)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            link_or_copy(token, target)
+            shutil.copymode(token, target)
+
+    # the simulated years are set in the member copy of the config file(s)
+    if simulated_years is not None:
+        for token in tokens[1:]:
+            if os.path.isfile(token):
+                target = os.path.join(member_dir, token)
+                with open(token, 'r') as f:
+                    text = set_config_years(f.read(), simulated_years[0], simulated_years[1])
+                os.remove(target)
+                with open(target, 'w') as f:
+                    f.write(text)
+
+    os.makedirs(os.path.join(member_dir, os.path.dirname(GLAM_OUTPUT)))
+    return None
+
+
+def run_member(args):
+    """
+    This function stage and run GLAM for one ensemble member in its own
+    working directory.
+    :return the name of the GLAM output file of the member
+    """
+    year, glam_command, wth_path, sta_name, forecastyear, lat, lon, member_weather, simulated_years = args
+    starttime = time.time()
+    member_dir = os.path.join(SCRATCH_PATH, 'member_' + str(year))
+    stage_member(member_dir, glam_command, wth_path, sta_name, forecastyear, lat, lon, member_weather,
+                 simulated_years)
+
+    # run the GLAM crop model
+    output = run_glam(glam_command, member_dir)
+    member_times[year] = time.time() - starttime
+    return output
+
+
+def run_ensemble(glam_command, wth_path, sta_name, forecastyear, lat, lon, years, members, processes=None,
+                 simulated_years=None):
+    """
+    This function run GLAM for all the ensemble members on a bounded pool of
+    workers, each member in its own working directory.
+    :param glam_command: the GLAM command line to run the model (as string)
+    :param wth_path: the file path where the .wth files are present (as string)
+    :param sta_name: name of station or location
+    :param forecastyear: the year for which we are going to forecast yield
+    :param lat: latitude of the location in degrees
+    :param lon: longitude of the location in degrees
+    :param years: the climatological year of each member
+    :param members: the GLAM weather data (day x 5) or the .wth file name of each member
+    :param processes: number of members run at the same time (default number of cpus)
+    :param simulated_years: if given (first year, last year), the members simulate only these years
+    :return the names of the GLAM output files in the member order
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(years)))
+
+    jobs = [(years[i], glam_command, wth_path, sta_name, forecastyear, lat, lon, members[i], simulated_years)
+            for i in range(0, len(years))]
+    # the members run as GLAM processes so threads are enough to keep them busy
+    pool = ThreadPool(processes)
+    try:
+        outputs = pool.map(run_member, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return outputs
@@ -0,0 +1,78 @@
+# =============================================================#
+# GLAM output (maize.out) parser and ensemble output store
+# ============================================================#
+# This module is used to read the GLAM outputs of all the
+# ensemble members into one array (member x simulated year x
+# output column), reading each file only once, and to keep this
+# array in a single binary file (.npz) with the climatological
+# year of each member, so the later stages and analysis do not
+# parse the GLAM text files again.
+# ==============================================================#
+import numpy as np
+
+YIELD_COLUMN = 7  # the column of the yield in the GLAM output
+
+
+def read_glam_output(filename):
+    """
+    This function read a GLAM output file.
+    :param filename: the GLAM output file (e.g. maize.out)
+    :return the output array (simulated year x output column)
+    """
+    with open(filename, 'r') as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    ncols = len(lines[0].split())
+    values = np.array(' '.join(lines).split(), dtype=float)
+    return np.reshape(values, (len(lines), ncols))
+
+
+def stack_outputs(outputs):
+    """
+    This function put the outputs of the members in one array. When the
+    members simulated a different number of years the missing rows are NaN.
+    :param outputs: list of the output arrays (simulated year x output column)
+    :return the output array (member x simulated year x output column)
+    """
+    outputs = [np.atleast_2d(output) for output in outputs]
+    nrows = max(output.shape[0] for output in outputs)
+    ncols = max(output.shape[1] for output in outputs)
+    ensemble = np.full((len(outputs), nrows, ncols), np.nan)
+    for i in range(0, len(outputs)):
+        ensemble[i, :outputs[i].shape[0], :outputs[i].shape[1]] = outputs[i]
+    return ensemble
+
+
+def read_glam_outputs(filenames):
+    """
+    This function read the GLAM output files of all the members (each
+    file is read once).
+    :param filenames: list of the GLAM output files in the member order
+    :return the output array (member x simulated year x output column)
+    """
+    return stack_outputs([read_glam_output(filename) for filename in filenames])
+
+
+def save_ensemble_output(filename, climayears, ensemble, climatology=None):
+    """
+    This function save the GLAM outputs of the ensemble in a single binary file.
+    :param filename: the name of the file (.npz)
+    :param climayears: the climatological year of each member
+    :param ensemble: the output array (member x simulated year x output column)
+    :param climatology: the output of the climatology run (climatological year x output column)
+                        when the members simulated the forecast year only
+    :return None
+    """
+    if climatology is None:
+        np.savez(filename, climayears=np.asarray(climayears), output=ensemble)
+    else:
+        np.savez(filename, climayears=np.asarray(climayears), output=ensemble, climatology=climatology)
+    return None
+
+
+def load_ensemble_output(filename):
+    """
+    This function load the GLAM outputs of the ensemble saved by save_ensemble_output.
+    :return a tuple (climayears, output array (member x simulated year x output column))
+    """
+    data = np.load(filename)
+    return data['climayears'], data['output']
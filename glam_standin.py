@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# =============================================================#
+# Stand-in of the GLAM crop model executable
+# ============================================================#
+# This script is used in place of the (licensed) GLAM binary to
+# test and benchmark TAMSAT-ALERT-GLAM. It is called with the
+# same command line as GLAM:
+#   ./glam_standin.py <config file> SET <yield gap parameter>
+# and, like GLAM, it reads the daily weather files (.wth) and
+# the soils file and writes output/maize.out (one tab separated
+# row of 43 columns per simulated year, yield in column 7).
+# The yield is a deterministic function of the weather (simple
+# water balance and radiation use efficiency model) so the same
+# inputs always give the same output.
+#
+# The config file is read for the lines "KEY value" below, the
+# other lines (e.g. a real GLAM config file) are ignored:
+#   ISYR        first simulated year (default first weather year)
+#   IEYR        last simulated year (default last weather year)
+#   WTH_DIR     folder of the weather files
+#               (default <config folder>/ascii_input/wth/)
+#   SOILS_FILE  soils file (default <config folder>/soils.txt)
+#   RUNTIME     artificial run time in seconds (default 0)
+# The environment variable GLAM_STANDIN_RUNTIME overrides RUNTIME.
+# ==============================================================#
+import numpy as np
+import os
+import re
+import sys
+import time
+
+NCOLUMNS = 43
+ROW_FORMAT = '\t'.join(['%4d', '%8.3f', '%8.3f', '%3d', '%3d', '%9.2f', '%9.2f', '%6.0f.', '%6.0f.', '%6.2f',
+                        '%6.2f', '%5.1f', '%5.1f'] + ['%8.2f'] * (NCOLUMNS - 13)) + '\n'
+
+
+def read_config(configfile):
+    """
+    This function read the settings of the stand-in from the config file.
+    """
+    folder = os.path.dirname(configfile)
+    config = {'ISYR': None, 'IEYR': None, 'RUNTIME': '0',
+              'WTH_DIR': os.path.join(folder, 'ascii_input', 'wth'),
+              'SOILS_FILE': os.path.join(folder, 'soils.txt')}
+    with open(configfile, 'r') as f:
+        for line in f:
+            fields = line.replace('=', ' ').split()
+            if len(fields) >= 2 and fields[0].upper() in config:
+                config[fields[0].upper()] = fields[1]
+    config['RUNTIME'] = os.environ.get('GLAM_STANDIN_RUNTIME', config['RUNTIME'])
+    return config
+
+
+def weather_files(wth_dir):
+    """
+    This function find the weather file of each year (<station>001001<year>.wth),
+    the copies kept by TAMSAT-ALERT-GLAM (origi_*) are not weather inputs.
+    """
+    files = {}
+    for name in os.listdir(wth_dir):
+        match = re.match(r'^(?!origi_)(.+)001001(\d{4})\.wth$', name)
+        if match:
+            files[int(match.group(2))] = os.path.join(wth_dir, name)
+    return files
+
+
+def read_weather(filename):
+    """
+    This function read a GLAM weather file.
+    :return a tuple (lat, lon, weather (day x [date, srad, tmax, tmin, rain]))
+    """
+    with open(filename, 'r') as f:
+        lines = f.read().splitlines()
+    station = lines[2].split()
+    weather = np.array(' '.join(lines[4:]).split(), dtype=float).reshape(-1, 5)
+    return float(station[1]), float(station[2]), weather
+
+
+def simulate(weather, rll, dul, ygp):
+    """
+    This function simulate the crop of one year.
+    :param weather: the weather data (day x [date, srad, tmax, tmin, rain])
+    :param rll: lower limit of the soil water content (m3 m-3)
+    :param dul: drained upper limit of the soil water content (m3 m-3)
+    :param ygp: the yield gap parameter (SET value of the command line)
+    :return a dictionary of the simulated values
+    """
+    srad, tmax, tmin, rain = weather[:, 1], weather[:, 2], weather[:, 3], weather[:, 4]
+
+    # sowing on the first day from day 100 with 20 mm of rain in 5 days (day 150 at the latest)
+    rain5 = np.convolve(rain, np.ones(5), 'full')[:len(rain)]
+    wet = np.nonzero(rain5[99:150] >= 20.)[0]
+    sow = 100 + (wet[0] if len(wet) else 50)
+    season = slice(sow - 1, min(sow - 1 + 120, len(rain)))
+
+    # daily water balance of 1 m of soil (bucket model)
+    awc = max(dul - rll, 0.01) * 1000.
+    tmean = (tmax + tmin) / 2.
+    pet = 0.0135 * (tmean + 17.8) * srad / 2.45
+    water = awc / 2.
+    stress = []
+    for day in range(season.start, season.stop):
+        water = min(water + rain[day], awc)
+        transpiration = min(pet[day], water)
+        water -= transpiration
+        stress.append(transpiration / pet[day] if pet[day] > 0 else 1.)
+    stress = np.array(stress)
+
+    # temperature response (0 below 8 C and above 38 C, 1 at 30 C)
+    tfac = np.clip(np.where(tmean[season] < 30., (tmean[season] - 8.) / 22., (38. - tmean[season]) / 8.), 0, 1)
+    # radiation use efficiency (g/MJ of PAR) scaled with the yield gap parameter
+    rue = 0.75 * ygp / 0.19
+    biomass = np.sum(rue * 0.5 * srad[season] * stress * tfac) * 10.  # kg/ha
+    hi = 0.25 + 0.25 * np.mean(stress[-40:])  # harvest index
+    return {'sow': sow, 'duration': season.stop - season.start, 'yield': biomass * hi,
+            'biomass': biomass, 'hi': hi, 'rain': np.sum(rain[season]),
+            'tmean': np.mean(tmean[season]), 'stress': np.mean(stress), 'tfac': np.mean(tfac), 'pet': np.sum(pet[season])}
+
+
+def main(args):
+    if len(args) < 1:
+        sys.stderr.write('usage: glam_standin.py <config file> [SET <yield gap parameter>]\n')
+        return 2
+    config = read_config(args[0])
+    ygp = float(args[args.index('SET') + 1]) if 'SET' in args else 0.19
+
+    files = weather_files(config['WTH_DIR'])
+    if not files:
+        sys.stderr.write('no weather files in %s\n' % config['WTH_DIR'])
+        return 1
+    startyear = int(config['ISYR'] or min(files))
+    endyear = int(config['IEYR'] or max(files))
+    missing = [year for year in range(startyear, endyear + 1) if year not in files]
+    if missing:
+        sys.stderr.write('missing weather files of the years %s\n' % missing)
+        return 1
+    soils = np.array(open(config['SOILS_FILE'], 'r').read().split(), dtype=float)
+    rll, dul = soils[2], soils[3]
+
+    rows = []
+    for year in range(startyear, endyear + 1):
+        lat, lon, weather = read_weather(files[year])
+        crop = simulate(weather, rll, dul, ygp)
+        row = [-99.] * NCOLUMNS
+        row[:13] = [year, lat, lon, crop['sow'], crop['duration'] // 30, crop['hi'], crop['stress'],
+                    crop['yield'], crop['biomass'], crop['tmean'], crop['tfac'], crop['rain'], crop['pet'] / 10.]
+        rows.append(ROW_FORMAT % tuple(row))
+
+    time.sleep(float(config['RUNTIME']))
+    if not os.path.isdir('output'):
+        os.makedirs('output')
+    with open(os.path.join('output', 'maize.out'), 'w') as f:
+        f.write(''.join(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
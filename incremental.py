@@ -0,0 +1,98 @@
+# =============================================================#
+# State of the previous run for the incremental daily update
+# ============================================================#
+# In operational forecasting the forcing file grows by one day
+# every morning. This module keep a small state file for each
+# station with what the previous run was made from:
+#   - the run settings (signature)
+#   - the number of forcing rows and the hash of those rows
+# It is used by calc_cropyield_wrapper.glam_run to detect the
+# appended days and to regenerate only the weather files which
+# changed since the previous run. The ensemble members are not
+# reused from here: the members whose GLAM inputs (command line,
+# executable, config, weather tree and member weather) did not
+# change are served from the GLAM results cache (glam_cache.py).
+# ==============================================================#
+import numpy as np
+import datetime as dt
+import os
+import json
+import hashlib
+
+STATE_PATH = './state/'
+
+
+def state_filename(sta_name):
+    """
+    This function return the name of the state file of a station.
+    """
+    return STATE_PATH + sta_name + '_state.json'
+
+
+def array_digest(data):
+    """
+    This function calculate the sha1 hash of the content of an array.
+    """
+    return hashlib.sha1(np.ascontiguousarray(data).tobytes()).hexdigest()
+
+
+def load_state(statefile):
+    """
+    This function read the state of the previous run (empty if there is none).
+    """
+    if not os.path.isfile(statefile):
+        return {}
+    with open(statefile, 'r') as f:
+        return json.load(f)
+
+
+def save_state(statefile, state):
+    """
+    This function save the state of the run, the file is replaced only
+    once it is completely written.
+    """
+    folder = os.path.dirname(statefile)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmpfile = statefile + '.tmp'
+    with open(tmpfile, 'w') as f:
+        json.dump(state, f)
+    if os.path.exists(statefile):
+        os.remove(statefile)
+    os.rename(tmpfile, statefile)
+    return None
+
+
+def first_changed_year(state, signature, data, datastartyear, leapremoved):
+    """
+    This function detect the days appended to the forcing data since the
+    previous run and return the first year whose data changed.
+    :param state: the state of the previous run
+    :param signature: the settings of the run (the previous run can only be
+                      reused if it was made with the same settings)
+    :param data: the forcing data array of the run (leap days as in the file)
+    :param datastartyear: the year the data set start
+    :param leapremoved: 1 if the leap days are not in the forcing data, 0 otherwise
+    :return the first year with new or modified data, None if the previous run
+            can not be reused at all (different settings or modified old data)
+    """
+    if state.get('signature') != signature:
+        return None
+    rows = state.get('rows')
+    if rows is None or rows > len(data):
+        return None
+    if array_digest(data[:rows]) != state.get('prefix_digest'):
+        return None
+    if leapremoved == 0:
+        return (dt.date(datastartyear, 1, 1) + dt.timedelta(days=rows)).year
+    return datastartyear + rows // 365
+
+
+def record_forcing(state, signature, data):
+    """
+    This function record the settings and the forcing data of the run in the state.
+    """
+    state['signature'] = signature
+    state['rows'] = len(data)
+    state['prefix_digest'] = array_digest(data)
+    return state
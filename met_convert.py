@@ -0,0 +1,57 @@
+# =============================================================#
+# Conversion of JULES forcing data to GLAM weather data
+# ============================================================#
+# This module is used by glam_data_prep and ensem_glam_data_prep
+# to convert the JULES forcing variables to the GLAM daily
+# weather variables. The conversion is done with whole array
+# operations so any number of years or ensemble members can be
+# converted in a single call.
+# GLAM weather columns: date (yyddd), SRAD, TMAX, TMIN, RAIN
+# ==============================================================#
+import numpy as np
+
+
+def forcing_to_glam(data, years):
+    """
+    This function convert JULES forcing data to GLAM weather data.
+    :param data: the forcing data (... x day x variable) starting on January 1st
+                 (at most 365 days on the day axis, leap days removed)
+    :param years: the year of the data, a single value or one value per element
+                  of the leading dimensions of data (e.g. per year or per member)
+    :return the GLAM weather data (... x day x [date, srad, tmax, tmin, rain])
+    """
+    data = np.asarray(data, dtype=float)
+    ndays = data.shape[-2]
+
+    # extracting daily SHORTWAVE RADIATION
+    daily_sw = data[..., 0]
+
+    # extracting daily RAINFALL
+    # when new data added values are in kg-m2s-1 --> mm/day
+    daily_precip = data[..., 2]
+    daily_precip = np.where(daily_precip < 0.002, daily_precip * 86400, daily_precip)  # up to 172 mm/day
+    # GLAM format do not accept daily rainfall above 99.9mm
+    # therefore if there is a value above this 99.9 will be
+    # set as a maximum value.
+    daily_precip = np.where(daily_precip >= 100.0, 99.9, daily_precip)
+
+    # extracting daily TEMPERATURE (mean) and DURATIONAL TEMPERATURE
+    daily_T = data[..., 4]
+    daily_dtr = data[..., 9]
+
+    # calculating MINIMUM and MAXIMUM TEMPERATURE
+    daily_tmin = ((2.0 * daily_T) - daily_dtr) / 2.0
+    daily_tmax = (2.0 * daily_T) - daily_tmin
+
+    # prepare the date in the GLAM format (yyddd)
+    yy = np.asarray(years) % 100
+    ddd = np.arange(1, ndays + 1)
+    date = np.broadcast_to(yy[..., np.newaxis] * 1000 + ddd, daily_sw.shape)
+
+    glam = np.empty(data.shape[:-1] + (5,))
+    glam[..., 0] = date
+    glam[..., 1] = daily_sw * 0.0864  # unit (MJ m-2 day-1)
+    glam[..., 2] = daily_tmax - 273.15  # unit (celsius)
+    glam[..., 3] = daily_tmin - 273.15  # unit (celsius)
+    glam[..., 4] = daily_precip  # unit (mm day-1)
+    return glam
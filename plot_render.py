@@ -0,0 +1,272 @@
+# =============================================================#
+# Batch rendering of the risk and climatology plots
+# ============================================================#
+# This module is used to render the plots of many risk results
+# (e.g. stations or forecast dates) off the critical path of the
+# risk calculation. Each plot is a job (kind, data, file, dpi)
+# where the data is precomputed (risk curve, categories, KDE
+# and histogram of the ensemble, climatology summary) so the
+# rendering only draws. The jobs are rendered with the Agg
+# canvas (no pyplot state machine) on a process pool, each
+# process reusing one figure per plot kind. The format of the
+# plots is given by the file extension (png, or a vector
+# format such as pdf or svg, for which the dpi is not used).
+# ==============================================================#
+import numpy as np
+import os
+from multiprocessing import Pool
+from matplotlib.figure import Figure, SubplotParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import scipy.stats as sps
+import seaborn as sns
+
+PLOT_PATH = './plot_output/'
+# the folder of the risk plots of each statistical method
+STAT_FOLDERS = {'normal': 'gaussian/', 'ecdf': 'ecdf/'}
+CATEGORY_LABELS = [('Very low', 'Very low (0-20%)', 'r'), ('Low', 'Low (20-40%)', 'm'),
+                   ('Average', 'Average (40-60%)', 'grey'), ('High', 'High (60-80%)', 'b'),
+                   ('Very high', 'Very high (80-100%)', 'g')]
+
+# the figure of each plot kind reused by the jobs rendered in this process
+_figures = {}
+
+
+# ====================================================================#
+# precomputed plot data
+# ====================================================================#
+
+
+def kde(values, bw=10., gridsize=100, cut=3):
+    """
+    This function calculate the gaussian kernel density estimate of the values
+    on a regular grid (the same grid as the seaborn kdeplot).
+    :param values: the sample values
+    :param bw: the bandwidth of the kernel (in the unit of the values)
+    :param gridsize: the number of grid points
+    :param cut: the grid extends cut * bw beyond the smallest and largest value
+    :return a tuple (grid, density)
+    """
+    values = np.asarray(values, dtype=float)
+    grid = np.linspace(np.min(values) - cut * bw, np.max(values) + cut * bw, gridsize)
+    density = np.mean(sps.norm.pdf((grid[:, None] - values) / bw), axis=1) / bw
+    return grid, density
+
+
+def histogram(values, nbins=9):
+    """
+    This function calculate the histogram of the ensemble values with the bins
+    spanning the values widened by 1%.
+    :return a tuple (bin boundaries, counts)
+    """
+    values = np.asarray(values, dtype=float)
+    binboundaries = np.linspace(min(values)-(0.01*(min(values))), max(values)+(0.01*(max(values))), nbins + 1)
+    counts = np.histogram(values, bins=binboundaries)[0]
+    return binboundaries, counts
+
+
+def plot_title(climastartyear, climaendyear, sta_name, f_date):
+    """
+    This function return the title of the risk plots.
+    """
+    return 'Theme: Probability of yield estimate (against ' + str(climastartyear) + '-' + str(climaendyear) + \
+           ' climatology)\nLocation: ' + sta_name + '\nForecast date: ' + f_date
+
+
+def risk_jobs(result, climastartyear, climaendyear, path=PLOT_PATH, dpi=300, fmt='png'):
+    """
+    This function prepare the jobs of the four risk plots of a risk result: the risk
+    curve (yieldprob), the probability of the categories (pentile), the probability
+    density (ked_plot) and the histogram (hist_plot) of the forecast ensemble.
+    :param result: the risk result (see calcrisk.risk_forecast)
+    :param climastartyear: the year climatology value start.
+    :param climaendyear: the year climatology value end.
+    :param path: the folder of the plots (the plots are in its gaussian or ecdf sub folder)
+    :param dpi: the resolution of the raster plots
+    :param fmt: the format of the plots (png, pdf, svg...)
+    :return the list of jobs (see render)
+    """
+    if result['stat'] not in STAT_FOLDERS:
+        raise ValueError('Please use only "normal" or "ecdf" stat method')
+    data = {'stat': result['stat'], 'f_date': result['forecast_date'],
+            'title': plot_title(climastartyear, climaendyear, result['sta_name'], result['forecast_date']),
+            'thresholds': result['thresholds'], 'probabilities': result['probabilities'],
+            'category_index': result['category_index'], 'categories': result['categories'],
+            'clima_kde': kde(result['climametric']), 'forecast_kde': kde(result['forecametric']),
+            'histogram': histogram(result['forecametric']), 'nmembers': len(result['forecametric'])}
+    prefix = path + STAT_FOLDERS[result['stat']] + result['sta_name'] + '_' + result['forecast_date']
+    return [(kind, data, prefix + '_' + kind + '.' + fmt, dpi)
+            for kind in ('yieldprob', 'pentile', 'ked_plot', 'hist_plot')]
+
+
+def climate_jobs(summary, path=PLOT_PATH, dpi=300, fmt='png'):
+    """
+    This function prepare the jobs of the plots of the forecast year weather against
+    the climatology average: cumulative rainfall, minimum and maximum temperature and
+    short wave radiation.
+    :param summary: the weather summary (see calcrisk.climate_summary)
+    :return the list of jobs (see render)
+    """
+    climalabel = 'Climatology average (' + str(summary['climayears'][0]) + '-' + str(summary['climayears'][-1]) + ')'
+    variables = [('cum_precip', 'cumprecip', 'Precipitation (mm)', 'Theme: Cumulative rainfall'),
+                 ('tmin', 'tmin', 'Temperature (C)', 'Theme: Minimum Temperature'),
+                 ('tmax', 'tmax', 'Temperature (C)', 'Theme: Maximum Temperature'),
+                 ('swr', 'swr', 'SWR (MJ m-2 day-1)', 'Theme: Short Wave Radiation')]
+    return [('climate', {'forecast': summary[name], 'climatology': summary['av_' + name],
+                         'label': str(summary['forecastyear']), 'climalabel': climalabel, 'ylabel': ylabel,
+                         'title': title + '\nLocation: ' + summary['sta_name']},
+             path + filename + '.' + fmt, dpi)
+            for filename, name, ylabel, title in variables]
+
+
+# ====================================================================#
+# rendering
+# ====================================================================#
+
+
+def highlight_point(ax, line, point, c, linestyle=':'):
+    """
+    This is an extra function to highlight three of the probability
+    points on the plot. It is part of the main plotting function.
+    """
+    label = ['well below average = ', 'Below average = ', 'Average = ', 'Above average = ']
+    c = c
+    xmin = 0  # ax.get_xlim()[0]
+    ymin = 0  # ax.get_ylim()[0]
+    if c == 'r':
+        label = label[0]
+    elif c == 'm':
+        label = label[1]
+    elif c == 'y':
+        label = label[2]
+    elif c == 'g':
+        label = label[3]
+    else:
+        raise ValueError('Only chose colors green,yellow or red')
+    ax.plot([xmin, point[0]], [point[1], point[1]], color=c, linestyle=linestyle, label=label+str(round(point[1], 2)))
+    ax.plot([point[0], point[0]], [ymin, point[1]], color=c, linestyle=linestyle)
+    return None
+
+
+def draw_yieldprob(ax, data):
+    """
+    This function draw the risk curve (original format ECB).
+    """
+    thresholds, probabilityyields = data['thresholds'], data['probabilities']
+    ax.plot(thresholds*100, thresholds, '--k', lw=1, label='Climatology')
+    line = ax.plot(thresholds*100, probabilityyields, 'k', lw=1, label='Projected')
+    # indicating critical points (above average, average, below average and well below average)
+    for i, c in zip(data['category_index'][::-1], ['g', 'y', 'm', 'r']):
+        highlight_point(ax, line[0], [thresholds[i]*100, probabilityyields[i]], c)
+    ax.set_xlabel('Climatology', fontsize=14)
+    ax.set_ylabel('Probability <= Climatological percentile', fontsize=14)
+    ax.legend()
+
+
+def draw_pentile(ax, data):
+    """
+    This function draw the probability of the categories (Pentiles bar plot format DA).
+    """
+    val = data['categories']
+    pos = np.arange(5)+.5        # the bar centers on the y axis
+    for i in range(0, 5):
+        ax.barh(pos[i], val[i]*100, align='center', color=CATEGORY_LABELS[i][2], label=CATEGORY_LABELS[i][1])
+    for i in range(0, 5):
+        ax.annotate(str(round(val[i]*100, 1))+'%', ((val[i]*100)+1, pos[i]), xytext=(0, 1),
+                    textcoords='offset points', fontsize=20)
+    ax.set_yticks(pos)
+    ax.set_yticklabels([label[0] for label in CATEGORY_LABELS])
+    ax.set_xlabel('Probability', fontsize=14)
+    ax.set_xlim(0, 101)
+    ax.legend()
+
+
+def draw_ked_plot(ax, data):
+    """
+    This function draw the probability density of the climatology and the forecast ensemble.
+    """
+    grid, density = data['clima_kde']
+    line = ax.plot(grid, density, label='Climatology')
+    ax.fill_between(grid, 0, density, color=line[0].get_color(), alpha=0.25)
+    grid, density = data['forecast_kde']
+    if data['stat'] == 'normal':
+        ax.plot(grid, density, color='g', label='Projected')
+    else:
+        ax.plot(grid, density, label='Projected')
+    ax.set_ylim(0, None)
+    ax.set_xlabel('Yield (Kg/ha)', fontsize=14)
+    ax.set_ylabel('Probability density', fontsize=14)
+    ax.legend()
+
+
+def draw_hist_plot(ax, data):
+    """
+    This function draw the histogram of the forecast ensemble.
+    """
+    binboundaries, counts = data['histogram']
+    ax.bar(binboundaries[:-1], counts, width=np.diff(binboundaries), align='edge', color='b', alpha=0.4,
+           label=data['f_date'])
+    ax.set_xlabel('Yield ($\mathregular{Kg ha^{-1}}$)', fontsize=14)
+    ax.set_ylabel('Frequency', fontsize=14)
+    ax.set_xlim(binboundaries[0], binboundaries[-1])
+    ax.set_ylim(0, data['nmembers']+1)
+
+
+def draw_climate(ax, data):
+    """
+    This function draw a variable of the forecast year against the climatology average.
+    """
+    ax.plot(data['forecast'], 'b', label=data['label'])
+    ax.plot(data['climatology'], 'r', label=data['climalabel'])
+    ax.set_xlabel('DOY', fontsize=14)
+    ax.set_ylabel(data['ylabel'], fontsize=14)
+    ax.legend()
+
+
+DRAW = {'yieldprob': draw_yieldprob, 'pentile': draw_pentile, 'ked_plot': draw_ked_plot,
+        'hist_plot': draw_hist_plot, 'climate': draw_climate}
+
+
+def render_job(job):
+    """
+    This function render a plot job in the figure of its kind.
+    :param job: a tuple (kind, data, filename, dpi)
+    :return the file name of the plot
+    """
+    kind, data, filename, dpi = job
+    if kind not in _figures:
+        fig = Figure(figsize=(8, 6))
+        FigureCanvasAgg(fig)
+        _figures[kind] = fig
+    fig = _figures[kind]
+    fig.clf()
+    # the margins set by tight_layout for the previous plot are not kept
+    fig.subplotpars = SubplotParams()
+    with sns.axes_style("ticks"):
+        ax = fig.add_subplot(111)
+    DRAW[kind](ax, data)
+    ax.set_title(data['title'], loc='left', fontsize=14)
+    ax.tick_params(labelsize=14)
+    # the renderer of the figure resolution (not the one of the last plot saved)
+    fig.tight_layout(renderer=fig.canvas.get_renderer())
+    fig.savefig(filename, dpi=dpi)
+    return filename
+
+
+def render(jobs, processes=None):
+    """
+    This function render the plot jobs, on a pool of processes if processes is given.
+    :param jobs: the list of jobs (kind, data, filename, dpi), see risk_jobs and climate_jobs
+    :param processes: the number of processes (the jobs are rendered in this process if None)
+    :return the list of the plot files
+    """
+    for folder in set(os.path.dirname(job[2]) for job in jobs):
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+    if processes is None or processes <= 1 or len(jobs) <= 1:
+        return [render_job(job) for job in jobs]
+    pool = Pool(min(processes, len(jobs)))
+    try:
+        return pool.map(render_job, jobs, chunksize=max(1, len(jobs) // (4 * processes)))
+    finally:
+        pool.close()
+        pool.join()
@@ -1,66 +1,70 @@
 import numpy as np
 import datetime as dt
 import os
+from forcing_cache import load_forcing
 
 
-def prepare_historical_run(filename, leapremoved, datastartyear):
+def leap_day_mask(datastartyear, ndays):
+    """
+    Boolean mask of the 29th February rows of a daily series.
+
+    Input Param: datastartyear: the year at the start of the data (the series must start on January 1st)
+    Input Param: ndays: number of daily rows in the series
+    Outputs:
+    A boolean array of length ndays which is True on every 29th February (Gregorian calendar)
+    """
+    dates = np.datetime64('%04d-01-01' % datastartyear, 'D') + np.arange(ndays)
+    years = dates.astype('datetime64[Y]')
+    doy = (dates - years).astype(int)
+    yr = years.astype(int) + 1970
+    isleap = (yr % 4 == 0) & ((yr % 100 != 0) | (yr % 400 == 0))
+    return isleap & (doy == 59)
+
+
+def remove_leap_days(data, datastartyear):
+    """
+    Remove the 29th February rows from a daily series in a single pass.
+
+    Input Param: data: daily data array (days on the first axis) starting on January 1st
+    Input Param: datastartyear: the year at the start of the data
+    Outputs:
+    A copy of data with the leap days removed (365 days in every year)
+    """
+    return data[~leap_day_mask(datastartyear, len(data))]
+
+
+def prepare_historical_run(filename, leapremoved, datastartyear, noleapfile=None):
     """
     
     Input Param: filename: name of the file with the data in it. The data must be daily data and must start on January 1st.
     Input Param: leap: set to 1 if leap years are contained in the data and 0 otherwise
     Input Param: datastartyear: set to the year at the start of the data
+    Input Param: noleapfile: if given, the data with leaps removed is also written to this text file
     Outputs:
     A tuple containing two arrays: data with leaps removed; data with leaps not removed
     """
-    data = np.genfromtxt(filename)
+    data = load_forcing(filename)
     dataorig = data
     if leapremoved == 0:
-        if datastartyear % 4 == 1: # if the start year is not a leap year (Matthew)
-            for t in range(424,len(data),1459): 
-                data = np.delete(data, (t),axis=0)
-        elif datastartyear % 4 == 2: # if the start year is not a leap year (Mark)
-            for t in range(789,len(data),1459): 
-                data = np.delete(data, (t),axis=0)
-        elif datastartyear % 4 == 3: # if the start year is not a leap year (Luke)
-            for t in range(1154,len(data),1459): 
-                data = np.delete(data, (t),axis=0)
-        elif datastartyear % 4 == 0: # if the start year is a leap year (Jhon)
-            for t in range(59,len(data),1459):
-                data = np.delete(data, (t),axis=0) 
-        else:
-            raise ValueError('There is a problem on the datastartyear value. Please check on the config_file.txt')
-    np.savetxt('alldata_noleap.txt',data,delimiter=' ',fmt='%6.2f')
+        data = remove_leap_days(data, datastartyear)
+    if noleapfile is not None:
+        np.savetxt(noleapfile,data,delimiter=' ',fmt='%6.2f')
     return data, dataorig
 
 
-def prepare_ensemble_runs(init_year, init_month, init_day, periodstart_year, periodstart_month,
-                          periodstart_day, periodend_year, periodend_month, periodend_day, datastartyear,
-                          climstartyear, climendyear, leapinit, leaparray, nonleaparray):
+def ensemble_views(init_year, init_month, init_day, periodstart_year, periodstart_month,
+                   periodstart_day, periodend_year, periodend_month, periodend_day, datastartyear,
+                   climstartyear, climendyear, leapinit, leaparray, nonleaparray):
     """
-    Input parameters:
-    init_year: Year of first date weather is unknown (last day of the present/hindcast equivalent)
-    init_month: Month of first date weather is unknown (last day of the present/hindcast equivalent)
-    init_day: Day of first date weather is unknown (last day of the present/hindcast equivalent)
-    periodstart_year: Year to start the hindcast system. This should include the whole period of interest and any spin up  
-    periodstart_month: Month to start the hindcast system. This should include the whole period of interest and any spin up 
-    periodstart_day: Day to start the hindcast system. This should include the whole period of interest and any spin up 
-    periodend_year: Year that the hindcast system runs until. This should extend beyond the period of interest
-    periodend_month: Month that the hindcast system runs until. This should extend beyond the period of interest
-    periodend_day: Day that the hindcast system runs until. This should extend beyond the period of interest
-    datastartyear: Year for which the data starts
-    climstartyear: First year of climatology (for weather generator)
-    climendyear: Last year of climatology (for weather generator)
-    leapinit: 1 to retain leap years in the initialization step; 0 to not retain leap years
-    leaparray: array of input data including leap years [if leapinit is set to zero, this can be a dummy variable]
-    nonleaparray: array of input data not including leap years
+    Input parameters: same as prepare_ensemble_runs
     Outputs:
-    nothing returned from the function. The function will write a zip file containing driving data for each ensemble member
-    
+    A tuple (history, future, years) of zero-copy views of the input data:
+    history: the observed data from the period start to the forecast initialization (day x variable),
+             shared by every ensemble member
+    future: the climatological data after the forecast initialization (member x day x variable),
+            a strided view where member i starts 365 rows after member i-1
+    years: the climatological year of each ensemble member
    """
-    # 1. create a folder to put the ensemble crop yield files
-    if not os.path.isdir("./ensemrun"):
-        os.makedirs("./ensemrun")
-
     # Ensure that the data have two dimensions
     if len(np.shape(leaparray)) == 1:
         leaparray = np.reshape(leaparray,(len(leaparray),1))
@@ -86,26 +90,79 @@ def prepare_ensemble_runs(init_year, init_month, init_day, periodstart_year, per
     
     number_future_days = (dt.date(periodend_year,periodend_month,periodend_day) - dt.date(init_year,init_month,init_day)).days #Note that this is slightly approximate because it may or may not include a leap day in the calculation. But this should not matter as users will be directed to include a forecast period end well after their period of interest
 
-    # Calculate the start and end indices in the non-leap file for each forecast ensemble member
-    
-    forecaststart_index = np.arange((365*(climstartyear-datastartyear)+ doy_init), (climendyear-datastartyear+1)*365,365) # climstartyear
-
-    forecastend_index = forecaststart_index + number_future_days
+    # Calculate the start index in the non-leap file of the first forecast ensemble member,
+    # the following members start one (365 days) year later each
+    forecaststart_index = 365*(climstartyear-datastartyear) + doy_init
     years = np.arange(climstartyear,climendyear+1)
 
-    filenames = []
-    for i in np.arange(0, len(forecaststart_index)):
-        filenames.append(str("ensrun_")+str(years[i])+".txt")
+    if forecaststart_index + 365*(len(years)-1) + number_future_days > len(nonleaparray):
+        raise ValueError('The data is too short for the ensemble of climatological years %s-%s '
+                         'up to the forecast period end.' % (climstartyear, climendyear))
+
+    if leapinit == 0:
+        history = nonleaparray[periodstart_index:init_index,:]
+    if leapinit == 1:
+        history = leaparray[periodstart_index:init_index,:]
+
+    # the members overlap in the non-leap data so they are all views of the same rows
+    rowstride, colstride = nonleaparray.strides
+    future = np.lib.stride_tricks.as_strided(nonleaparray[forecaststart_index:],
+                                             shape=(len(years), number_future_days, nonleaparray.shape[1]),
+                                             strides=(365*rowstride, rowstride, colstride), writeable=False)
+    return history, future, years
+
+
+def prepare_ensemble_runs(init_year, init_month, init_day, periodstart_year, periodstart_month,
+                          periodstart_day, periodend_year, periodend_month, periodend_day, datastartyear,
+                          climstartyear, climendyear, leapinit, leaparray, nonleaparray, write_files=True,
+                          ndays=None):
+    """
+    Input parameters:
+    init_year: Year of first date weather is unknown (last day of the present/hindcast equivalent)
+    init_month: Month of first date weather is unknown (last day of the present/hindcast equivalent)
+    init_day: Day of first date weather is unknown (last day of the present/hindcast equivalent)
+    periodstart_year: Year to start the hindcast system. This should include the whole period of interest and any spin up  
+    periodstart_month: Month to start the hindcast system. This should include the whole period of interest and any spin up 
+    periodstart_day: Day to start the hindcast system. This should include the whole period of interest and any spin up 
+    periodend_year: Year that the hindcast system runs until. This should extend beyond the period of interest
+    periodend_month: Month that the hindcast system runs until. This should extend beyond the period of interest
+    periodend_day: Day that the hindcast system runs until. This should extend beyond the period of interest
+    datastartyear: Year for which the data starts
+    climstartyear: First year of climatology (for weather generator)
+    climendyear: Last year of climatology (for weather generator)
+    leapinit: 1 to retain leap years in the initialization step; 0 to not retain leap years
+    leaparray: array of input data including leap years [if leapinit is set to zero, this can be a dummy variable]
+    nonleaparray: array of input data not including leap years
+    write_files: 1/True to also export each ensemble member as ./ensemrun/ensrun_<year>.txt
+    ndays: if given, only the first ndays days of each ensemble member are returned
+    Outputs:
+    The driving data of all the ensemble members as one array (member x day x variable)
+    The members are copied into the array (they are written to files and read as whole
+    members by the callers); the in memory runs use the views of ensemble_views instead.
+    
+   """
+    history, future, years = ensemble_views(init_year, init_month, init_day, periodstart_year, periodstart_month,
+                                            periodstart_day, periodend_year, periodend_month, periodend_day,
+                                            datastartyear, climstartyear, climendyear, leapinit, leaparray,
+                                            nonleaparray)
+
+    # fill the ensemble cube in two whole-array assignments (no per member copies)
+    total_days = len(history) + future.shape[1]
+    if ndays is not None:
+        total_days = min(ndays, total_days)
+    nhist = min(len(history), total_days)
+    ensemble = np.empty((len(years), total_days, future.shape[2]), dtype=future.dtype)
+    ensemble[:, :nhist, :] = history[:nhist]
+    ensemble[:, nhist:, :] = future[:, :total_days - nhist, :]
 
-    for i in np.arange(0,len(forecaststart_index)):
-        if leapinit == 0:
-            dataout = np.vstack((nonleaparray[periodstart_index:init_index,:],nonleaparray[forecaststart_index[i]:forecastend_index[i],:]))
-        if leapinit == 1:
-            dataout = np.vstack((leaparray[periodstart_index:init_index,:],nonleaparray[forecaststart_index[i]:forecastend_index[i],:]))
-        
-        np.savetxt('./ensemrun/'+filenames[i], dataout, delimiter=' ', fmt='%6.2f')
+    if write_files:
+        # 1. create a folder to put the ensemble crop yield files
+        if not os.path.isdir("./ensemrun"):
+            os.makedirs("./ensemrun")
 
-    # print filenames[i]
+        for i in np.arange(0, len(years)):
+            np.savetxt('./ensemrun/ensrun_'+str(years[i])+'.txt', ensemble[i], delimiter=' ', fmt='%6.2f')
 
     # call("zip -qq ensdriving.zip ensrun*", shell=True)
     # call("rm ensrun*", shell=True)
+    return ensemble
@@ -1,7 +1,7 @@
 from config import *
 from prepare_driving import *
 
-outdata = prepare_historical_run(filename, leapremoved, datastartyear)
+outdata = prepare_historical_run(filename, leapremoved, datastartyear, 'alldata_noleap.txt')
 output = prepare_ensemble_runs(init_year, init_month, init_day, periodstart_year, periodstart_month,
                                periodstart_day, periodend_year, periodend_month, periodend_day,
                                datastartyear, climstartyear, climendyear, leapinit, outdata[1], outdata[0])
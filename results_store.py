@@ -0,0 +1,187 @@
+# =============================================================#
+# Append-only store of the risk results
+# ============================================================#
+# This module keep the result of every risk forecast (ensemble
+# and climatological metric, weighting metric, risk curve and
+# probability of the categories) in a SQLite database, so the
+# history of the forecasts is not overwritten by the next run
+# and can be queried by station, forecast date range,
+# climatology window, weights and statistical method. The rows
+# are only inserted (never updated or deleted), each with the
+# time it was stored. The arrays are kept as float64 blobs and
+# the probability of the categories as columns so they can be
+# queried directly.
+# ==============================================================#
+import numpy as np
+import os
+import json
+import sqlite3
+import datetime as dt
+
+DB_PATH = './data_output/results.sqlite'
+CATEGORY_COLUMNS = ('very_low', 'low', 'average', 'high', 'very_high')
+ARRAY_COLUMNS = ('climametric', 'forecametric', 'wmetric', 'thresholds', 'probabilities',
+                 'probabilities_bounds', 'categories_bounds')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS risk (
+    id INTEGER PRIMARY KEY,
+    sta_name TEXT NOT NULL,
+    forecast_date TEXT NOT NULL,
+    climastartyear INTEGER NOT NULL,
+    climaendyear INTEGER NOT NULL,
+    weights TEXT NOT NULL,
+    stat TEXT NOT NULL,
+    stored TEXT NOT NULL,
+    projected_mean REAL,
+    projected_sd REAL,
+    %s,
+    %s
+);
+CREATE INDEX IF NOT EXISTS risk_station_date ON risk (sta_name, forecast_date);
+CREATE INDEX IF NOT EXISTS risk_window ON risk (climastartyear, climaendyear, weights, stat);
+""" % (',\n    '.join(name + ' REAL' for name in CATEGORY_COLUMNS),
+       ',\n    '.join(name + ' BLOB' for name in ARRAY_COLUMNS))
+
+
+def connect(dbfile=DB_PATH):
+    """
+    This function open the results database (created if it does not exist).
+    """
+    folder = os.path.dirname(dbfile)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    connection = sqlite3.connect(dbfile)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def weights_key(weights):
+    """
+    This function return the weights as stored in the database (json list of floats).
+    """
+    return json.dumps([float(weight) for weight in weights])
+
+
+def iso_date(f_date):
+    """
+    This function return the forecast date (dd-Mon-yyyy, as in the risk result) as yyyy-mm-dd.
+    """
+    return dt.datetime.strptime(f_date, '%d-%b-%Y').date().isoformat()
+
+
+def to_blob(values):
+    """
+    This function return the array as a float64 blob (None stays None).
+    """
+    if values is None:
+        return None
+    return sqlite3.Binary(np.ascontiguousarray(values, dtype='<f8').tobytes())
+
+
+def from_blob(blob, shape=None):
+    """
+    This function return the array of a float64 blob (None stays None).
+    """
+    if blob is None:
+        return None
+    values = np.frombuffer(bytes(blob), dtype='<f8')
+    return values if shape is None else values.reshape(shape)
+
+
+def append(results, climastartyear, climaendyear, weights, dbfile=DB_PATH):
+    """
+    This function add risk results to the store (in a single transaction).
+    :param results: a risk result or a list of risk results (see calcrisk.risk_forecast),
+                    each with sta_name and forecast_date
+    :param climastartyear: the year climatology value start.
+    :param climaendyear: the year climatology value end.
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param dbfile: the results database
+    :return the number of results stored
+    """
+    if isinstance(results, dict):
+        results = [results]
+    stored = dt.datetime.now().isoformat()
+    rows = []
+    for result in results:
+        rows.append([result['sta_name'], iso_date(result['forecast_date']), int(climastartyear), int(climaendyear),
+                     weights_key(weights), result['stat'], stored, result['projected_mean'],
+                     result['projected_sd']] + [float(value) for value in result['categories']] +
+                    [to_blob(result.get(name)) for name in ARRAY_COLUMNS])
+    columns = ('sta_name', 'forecast_date', 'climastartyear', 'climaendyear', 'weights', 'stat', 'stored',
+               'projected_mean', 'projected_sd') + CATEGORY_COLUMNS + ARRAY_COLUMNS
+    connection = connect(dbfile)
+    try:
+        with connection:
+            connection.executemany('INSERT INTO risk (%s) VALUES (%s)' % (', '.join(columns),
+                                                                           ', '.join('?' * len(columns))), rows)
+    finally:
+        connection.close()
+    return len(rows)
+
+
+def query(sta_name=None, start=None, end=None, climastartyear=None, climaendyear=None, weights=None,
+          stat=None, latest=False, arrays=True, dbfile=DB_PATH):
+    """
+    This function return the stored risk results matching all the given criteria,
+    ordered by station, forecast date and time stored.
+    :param sta_name: the name of the station or point
+    :param start: the first forecast date (datetime.date or yyyy-mm-dd)
+    :param end: the last forecast date (datetime.date or yyyy-mm-dd)
+    :param climastartyear: the year climatology value start.
+    :param climaendyear: the year climatology value end.
+    :param weights: tercile forecast probabilities of the weighting metric used
+    :param stat: the statistical method (normal or ecdf)
+    :param latest: if True only the last result stored for each station, forecast date,
+                   climatology window, weights and statistical method is returned
+    :param arrays: if False the arrays (metrics and risk curve) are not read
+    :param dbfile: the results database
+    :return a list of dictionaries (one per result) with the columns of the store,
+            the categories as an array and the arrays decoded
+    """
+    where = []
+    values = []
+    for column, value in [('sta_name', sta_name), ('climastartyear', climastartyear),
+                          ('climaendyear', climaendyear), ('stat', stat)]:
+        if value is not None:
+            where.append(column + ' = ?')
+            values.append(value)
+    if weights is not None:
+        where.append('weights = ?')
+        values.append(weights_key(weights))
+    if start is not None:
+        where.append('forecast_date >= ?')
+        values.append(str(start))
+    if end is not None:
+        where.append('forecast_date <= ?')
+        values.append(str(end))
+    if latest:
+        where.append('id IN (SELECT MAX(id) FROM risk GROUP BY sta_name, forecast_date, climastartyear, '
+                     'climaendyear, weights, stat)')
+
+    columns = ('id', 'sta_name', 'forecast_date', 'climastartyear', 'climaendyear', 'weights', 'stat', 'stored',
+               'projected_mean', 'projected_sd') + CATEGORY_COLUMNS
+    if arrays:
+        columns += ARRAY_COLUMNS
+    sql = 'SELECT %s FROM risk' % ', '.join(columns)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY sta_name, forecast_date, id'
+
+    connection = connect(dbfile)
+    try:
+        rows = connection.execute(sql, values).fetchall()
+    finally:
+        connection.close()
+
+    results = []
+    for row in rows:
+        result = dict(zip(columns, row))
+        result['weights'] = json.loads(result['weights'])
+        result['categories'] = np.array([result.pop(name) for name in CATEGORY_COLUMNS])
+        if arrays:
+            for name in ARRAY_COLUMNS:
+                result[name] = from_blob(result[name], (2, -1) if name.endswith('_bounds') else None)
+        results.append(result)
+    return results
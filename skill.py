@@ -0,0 +1,131 @@
+# =============================================================#
+# Skill scores of the hindcast risk forecasts
+# ============================================================#
+# This module is used to verify the probabilities of the five
+# yield categories (very low, low, average, high, very high)
+# forecast for a hindcast archive against the category of the
+# observed (reference run) yield. All the scores are calculated
+# for the whole archive at once (case x category arrays):
+#   - Brier score and Brier skill score (against climatology)
+#   - ROC area
+#   - reliability (forecast probability against observed
+#     frequency in probability bins)
+# ==============================================================#
+import numpy as np
+import scipy.stats as sps
+
+CATEGORIES = ('Very low', 'Low', 'Average', 'High', 'Very high')
+
+
+def category_bounds(climametric, stat):
+    """
+    This function calculate the climatological boundaries of the five categories
+    the same way the risk probabilities are calculated (see calcrisk.risk_probabilities).
+    :param climametric: climatological values of the metric (case x climatological year)
+    :param stat: statistical method used for the risk (ecdf or normal)
+    :return the upper bounds of the first four categories (case x 4)
+    """
+    climametric = np.atleast_2d(climametric)
+    if stat == 'normal':
+        climamean = np.mean(climametric, axis=1)[:, None]
+        climasd = np.std(climametric, axis=1)[:, None]
+        return sps.norm.ppf(np.array([0.2, 0.4, 0.6, 0.8]), climamean, climasd)
+    elif stat == 'ecdf':
+        # the k-th bound is the climatological value at the index k*nn of the ECDF
+        # (the ECDF values start with -inf so it is the (k*nn - 1)th sorted value)
+        nn = int(round(climametric.shape[1]/5., 0))
+        return np.sort(climametric, axis=1)[:, nn * np.arange(1, 5) - 1]
+    else:
+        raise ValueError('Please use only "normal" or "ecdf" stat method')
+
+
+def observed_category(observed, bounds):
+    """
+    This function return the category (0 = very low ... 4 = very high) of the observed values.
+    :param observed: the observed value of each case
+    :param bounds: the upper bounds of the first four categories (case x 4)
+    """
+    return np.sum(np.asarray(observed, dtype=float)[:, None] > bounds, axis=1)
+
+
+def outcomes(category, ncategories=len(CATEGORIES)):
+    """
+    This function return the observed outcome (1 if the category occurred, 0 otherwise)
+    of each case and category (case x category).
+    """
+    return (np.asarray(category)[:, None] == np.arange(ncategories)).astype(float)
+
+
+def brier_score(probs, category):
+    """
+    This function calculate the Brier score of each category.
+    :param probs: the forecast probability of the categories (case x category)
+    :param category: the observed category of each case
+    :return the Brier score of each category
+    """
+    return np.mean((probs - outcomes(category, probs.shape[1]))**2, axis=0)
+
+
+def brier_skill_score(probs, category):
+    """
+    This function calculate the Brier skill score of each category against the
+    climatological forecast (probability 1/number of categories for all cases).
+    """
+    obs = outcomes(category, probs.shape[1])
+    reference = np.mean((1. / probs.shape[1] - obs)**2, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 1 - brier_score(probs, category) / reference
+
+
+def roc_area(probs, category):
+    """
+    This function calculate the area under the ROC curve of each category
+    (Mann-Whitney statistic of the forecast probabilities of the cases where
+    the category occurred against the other cases, ties count half).
+    :param probs: the forecast probability of the categories (case x category)
+    :param category: the observed category of each case
+    :return the ROC area of each category (NaN when the category always or never occurred)
+    """
+    obs = outcomes(category, probs.shape[1])
+    ranks = np.apply_along_axis(sps.rankdata, 0, probs)
+    nevents = np.sum(obs, axis=0)
+    nnonevents = probs.shape[0] - nevents
+    with np.errstate(divide='ignore', invalid='ignore'):
+        area = (np.sum(ranks * obs, axis=0) - nevents * (nevents + 1) / 2.) / (nevents * nnonevents)
+    area[(nevents == 0) | (nnonevents == 0)] = np.nan
+    return area
+
+
+def reliability(probs, category, nbins=10):
+    """
+    This function calculate the reliability diagram of each category: the cases
+    are put in bins of forecast probability and the mean forecast probability is
+    compared with the observed frequency of the category in each bin.
+    :param probs: the forecast probability of the categories (case x category)
+    :param category: the observed category of each case
+    :param nbins: the number of probability bins between 0 and 1
+    :return a tuple (forecast probability, observed frequency, number of cases),
+            each (category x bin), the empty bins are NaN
+    """
+    ncat = probs.shape[1]
+    obs = outcomes(category, ncat)
+    bins = np.clip(np.floor(probs * nbins).astype(int), 0, nbins - 1)
+    index = (np.arange(ncat) * nbins + bins).ravel()
+    counts = np.bincount(index, minlength=ncat * nbins).reshape(ncat, nbins)
+    sumprob = np.bincount(index, weights=probs.ravel(), minlength=ncat * nbins).reshape(ncat, nbins)
+    sumobs = np.bincount(index, weights=obs.ravel(), minlength=ncat * nbins).reshape(ncat, nbins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sumprob / counts, sumobs / counts, counts
+
+
+def save_skill(filename, probs, category):
+    """
+    This function save the Brier score, Brier skill score and ROC area of each
+    category in a text file.
+    """
+    scores = np.array([np.arange(1, probs.shape[1] + 1), brier_score(probs, category),
+                       brier_skill_score(probs, category), roc_area(probs, category)]).T
+    headval = '1 = Very low(0-20%)  2 = Low(20-40%)   3 = Average(40-60%)  4 = High(60-80%)  5 = Very high(80-100%)\n' \
+              'Category    BrierScore    BrierSkillScore    ROCArea'
+    np.savetxt(filename, scores, delimiter=' ', header=headval, fmt='%i   %8.4f   %8.4f   %8.4f')
+    return None
@@ -0,0 +1,61 @@
+# =======================================================================##
+# Hindcast of TAMSAT-ALERT-GLAM (calc_cropyield_wrapper.glam_hindcast)
+# =======================================================================##
+# The hindcast is run with the GLAM stand-in (glam_standin.py) in place
+# of GLAM for forecast years inside the climatology period.
+# Run from the repository folder:
+#   python -m unittest discover tests
+# =======================================================================##
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark_glam_run
+import calc_cropyield_wrapper as wrapper
+
+DATASTARTYEAR = 1970
+DATAENDYEAR = 2011
+CLIMSTARTYEAR = 1980
+CLIMENDYEAR = 2009
+
+
+class HindcastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        benchmark_glam_run.setup(self.workdir, DATASTARTYEAR, DATAENDYEAR, CLIMSTARTYEAR)
+        os.chdir(self.workdir)
+
+        self.settings = {}
+        settings = {'filename': 'bench_forcing.txt', 'leapremoved': 0, 'leapinit': 1,
+                    'datastartyear': DATASTARTYEAR, 'dataendyear': DATAENDYEAR,
+                    'climastartyear': CLIMSTARTYEAR, 'climaendyear': CLIMENDYEAR,
+                    'wf_year': DATAENDYEAR, 'wth_path': benchmark_glam_run.WTH_PATH,
+                    'glam_command': './glam ' + benchmark_glam_run.CONFIG_PATH + 'bench.glam SET 0.19',
+                    'results_db': None}
+        for name, value in settings.items():
+            self.settings[name] = getattr(wrapper, name)
+            setattr(wrapper, name, value)
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(wrapper, name, value)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_same_climatology_for_every_case(self):
+        # the climatology must not depend on the weather of the members of the forecast year
+        result = wrapper.glam_hindcast([1995, 2000, 2005], [(5, 1)])
+        for c in range(1, len(result['year'])):
+            np.testing.assert_array_equal(result['climametric'][c], result['climametric'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
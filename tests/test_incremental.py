@@ -0,0 +1,94 @@
+# =======================================================================##
+# Incremental daily update of glam_run (calc_cropyield_wrapper)
+# =======================================================================##
+# The forcing file grows by one day every morning: the run is made once,
+# then one day is appended and the run is made again (twice). The GLAM
+# stand-in (glam_standin.py) is used in place of GLAM.
+# Run from the repository folder:
+#   python -m unittest discover tests
+# =======================================================================##
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import datetime as dt
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark_glam_run
+import calc_cropyield_wrapper as wrapper
+import glam_cache
+
+DATASTARTYEAR = 1970
+DATAENDYEAR = 2011
+CLIMSTARTYEAR = 1980
+CLIMENDYEAR = 2009
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        benchmark_glam_run.setup(self.workdir, DATASTARTYEAR, DATAENDYEAR, CLIMSTARTYEAR)
+        os.chdir(self.workdir)
+        with open('bench_forcing.txt', 'r') as f:
+            self.lines = f.read().splitlines()
+
+        self.settings = {}
+        settings = {'filename': 'bench_forcing.txt', 'leapremoved': 0, 'leapinit': 1,
+                    'datastartyear': DATASTARTYEAR, 'dataendyear': DATAENDYEAR,
+                    'climstartyear': CLIMSTARTYEAR, 'climendyear': CLIMENDYEAR,
+                    'climastartyear': CLIMSTARTYEAR, 'climaendyear': CLIMENDYEAR,
+                    'forecastyear': DATAENDYEAR, 'forecastmonth': 5, 'forecastday': 1,
+                    'periodstart_year': DATAENDYEAR, 'periodend_year': DATAENDYEAR + 1,
+                    'wf_year': DATAENDYEAR, 'wth_path': benchmark_glam_run.WTH_PATH,
+                    'glam_command': './glam ' + benchmark_glam_run.CONFIG_PATH + 'bench.glam SET 0.19',
+                    'results_db': None}
+        for name, value in settings.items():
+            self.settings[name] = getattr(wrapper, name)
+            setattr(wrapper, name, value)
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(wrapper, name, value)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def write_forcing(self, last):
+        """
+        This function write the forcing file up to (and including) the date last.
+        """
+        rows = (last - dt.date(DATASTARTYEAR, 1, 1)).days + 1
+        with open('bench_forcing.txt', 'w') as f:
+            f.write('\n'.join(self.lines[:rows]) + '\n')
+
+    def read_output(self, name):
+        with open(name, 'r') as f:
+            return f.read()
+
+    def test_append_one_day_then_rerun(self):
+        last = dt.date(DATAENDYEAR, 5, 30)
+        self.write_forcing(last)
+        wrapper.glam_run(incremental_update=True, plots=False)
+
+        for day in range(0, 2):
+            last += dt.timedelta(days=1)
+            self.write_forcing(last)
+            glam_cache.stats['hits'] = glam_cache.stats['misses'] = 0
+            wrapper.glam_run(incremental_update=True, plots=False)
+            # the member weather ends on the forecast date, all the members are reused
+            self.assertEqual(glam_cache.stats['misses'], 0)
+            self.assertEqual(glam_cache.stats['hits'], CLIMENDYEAR - CLIMSTARTYEAR + 1)
+        incremental = [self.read_output(name) for name in (wrapper.climafile, wrapper.forecastfile)]
+
+        # the same forecast made from scratch
+        shutil.rmtree(glam_cache.CACHE_PATH)
+        wrapper.glam_run(in_memory=True, plots=False)
+        self.assertEqual(incremental, [self.read_output(name) for name in (wrapper.climafile, wrapper.forecastfile)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,12 @@
 # This is a warning script for checking TAMSAT-ALERT_GLAM input variables
+import os
+import datetime as dt
+from forcing_cache import forcing_index, forcing_coverage
+from glam_exec import normpath
+
+# the columns of the JULES forcing file used (short wave radiation 0, rainfall 2,
+# temperature 4 and diurnal temperature range 9)
+FORCING_COLUMNS = 10
 
 
 def check_input_var(filename, sta_name, stat, wth_path, glam_command, soiltex, lat, lon,
@@ -157,3 +165,48 @@ def check_input_var(filename, sta_name, stat, wth_path, glam_command, soiltex, l
         raise ValueError("w_leadtime must be between 1 and 365")
 
     return None
+
+
+def check_forcing(filename, leapremoved, datastartyear, dataendyear, climstartyear, climendyear,
+                  forecastyear, forecastmonth, forecastday, periodend_year, periodend_month, periodend_day,
+                  wth_path):
+    """
+    This function check, before any data preparation, that the forcing file and the wth_path
+    folder exist and that the forcing data cover the run: the data end year, the forecast date
+    and the ensemble members of all the climatological years up to the forecast period end.
+    The forcing file is not parsed (see forcing_cache.forcing_index).
+    :param climstartyear: the first climatological year of the ensemble members
+    :param climendyear: the last climatological year of the ensemble members
+    :return the coverage of the forcing file (see forcing_cache.forcing_coverage)
+    """
+    if not os.path.isfile(filename):
+        raise ValueError("The forcing file %s does not exist!" % filename)
+    if not os.path.isdir(normpath(wth_path)):
+        raise ValueError("wth_path %s does not exist! Please create the folder of the weather files." % wth_path)
+
+    index = forcing_index(filename)
+    if index['rows'] == 0:
+        raise ValueError("The forcing file %s has no data!" % filename)
+    if index['columns'] < FORCING_COLUMNS:
+        raise ValueError("The forcing file %s has %s columns, at least %s columns (JULES forcing format) "
+                         "are required!" % (filename, index['columns'], FORCING_COLUMNS))
+
+    coverage = forcing_coverage(index['rows'], datastartyear, leapremoved)
+    if coverage['last'].year < dataendyear:
+        raise ValueError("The forcing file %s ends on %s, before dataendyear %s! (%s days from datastartyear %s)"
+                         % (filename, coverage['last'], dataendyear, index['rows'], datastartyear))
+    if coverage['last'] < dt.date(forecastyear, forecastmonth, forecastday):
+        raise ValueError("The forcing file %s ends on %s, before the forecast date %s!"
+                         % (filename, coverage['last'], dt.date(forecastyear, forecastmonth, forecastday)))
+
+    # the ensemble member of the last climatological year runs until the forecast period end
+    # (see prepare_driving.ensemble_views)
+    doy_init = (dt.date(forecastyear, forecastmonth, forecastday) - dt.date(forecastyear, 1, 1)).days
+    number_future_days = (dt.date(periodend_year, periodend_month, periodend_day) -
+                          dt.date(forecastyear, forecastmonth, forecastday)).days
+    if 365 * (climendyear - datastartyear) + doy_init + number_future_days > coverage['noleap_days']:
+        raise ValueError("The forcing file %s ends on %s, too short for the ensemble of climatological "
+                         "years %s-%s up to the forecast period end!"
+                         % (filename, coverage['last'], climstartyear, climendyear))
+    return coverage
+
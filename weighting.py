@@ -5,9 +5,24 @@
 # This module contain the weighting metric preparation function for
 # TAMSAT-ALERT-GLAM. It take the arguments given and prepare the weighting
 # metric of rainfall sum or mean temperature from the input data sets
+# The sums over any season are looked up in the cumulative sums of the
+# daily values (window_sums), which are calculated once per climatology.
+# A season running past the end of the year continues into the next
+# year (the year after the last climatological year is read as well).
 # =============================================================================##
 import numpy as np
 import datetime as dt
+import os
+from wthfile import load_climatology, wth_filename, clima_cache
+
+# the last day of year (non leap year) used as the season start of the months
+# shorter than wf_day (Feb, Apr, Jun, Sep and Nov)
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+MONTH_END_DOY = np.cumsum(MONTH_DAYS)
+
+# the cumulative sums of the climatologies in the climatology cache of wthfile,
+# an entry is dropped when its weather is no longer in that cache
+_window_sums = {}
 
 
 def weight_metric_prep(climayears, wth_path, sta_name, f_date, weight_var,
@@ -26,165 +41,157 @@ def weight_metric_prep(climayears, wth_path, sta_name, f_date, weight_var,
     :param wf_month: the first month of the season for which weighting is considered (e.g. wf_month = 6 if season used is JJA)
     :param wf_day: the first day for the season for which weighting is considered
     :param w_leadtime: the length of the day for which values are summed or averaged to prepare the weight metric
+    :param weightfile: the file the weighting metric is saved in (not saved if None)
 
-    :return weighted mean of forcayearyield values.
+    :return the weighting metric of the climatological years (also saved in weightfile).
     """
     # identify the Julian day of year of the forecast date
     fdoy = dt.datetime.strptime(f_date, '%d-%b-%Y')
     fdoy = fdoy.timetuple().tm_yday
 
-    # the season starting dates of the 12 months
-    # these dates are the dates set by the user for the forecast
-    # if it chose 25th date then it will be the 25th date of every
-    # month. When the 31st date is chosen it will keep the 30th date
-    # for all the months with 30 days and 28th day for Feb.
-    # These dates will be the start of the season for the weighting
-    # by adding the user defined lead time (w_leadtime)on it.
-    ss_date = []
-    for m in range(1, 13):
-        if m == 2 and wf_day > 28:
-            ss_date.append(59)    
-        elif m == 4 and wf_day > 30:
-            ss_date.append(120)
-        elif m == 6 and wf_day > 30:
-            ss_date.append(181)
-        elif m == 9 and wf_day > 30:
-            ss_date.append(273)
-        elif m == 11 and wf_day > 30:
-            ss_date.append(334)   
-        else:
-            dd = dt.datetime(wf_year, m, wf_day)
-            wdoy = dd.timetuple().tm_yday
-            ss_date.append(wdoy)
-
-    # for a single date forecast the weights are read from the ReadVar.py
-    # and they will be interpreted as the 90 (lead time) days forecast from the next month
-    # onwards.(e.g. if forecast month is 5 (May) the weights given will be considered as
-    # June-July-August(182 + leadtime)).
-#    wf_month = forecastmonth + 1  # the weights will be starting from the next month + leadtime days
-    
-    # generating the 4 seasons starting date (the seasons used in the weighting 'weight.txt')
-    if wf_month <= 9:
-        svals = ss_date[wf_month - 1: (wf_month - 1) + 4]
-    else:
-        svals1 = ss_date[wf_month - 1:]
-        svals2 = ss_date[:(4 - len(svals1))]
-        svals1.extend(svals2)  # concatenate the dates
-        svals = svals1
-    s1s = svals[0] 
-    s2s = svals[1]
-    s3s = svals[2]
-    s4s = svals[3]   
-
-    if weight_var == 0:
-        # read the file containing the climatological weather data
-        daily_precip = []
-        for i in range(0, len(climayears)):
-            climaprecip = np.genfromtxt(wth_path + sta_name + '001001' + str(climayears[i])+'.wth', skip_header=4)[:, 4]
-            daily_precip = np.append(daily_precip, climaprecip)
+    # the 4 seasons starting dates (the seasons used in the weighting 'weight.txt')
+    svals = season_starts(wf_year, wf_day)[(wf_month - 1 + np.arange(4)) % 12]
 
-        # Precipitation value of the climatological periods
-        outmat = np.reshape(daily_precip, (len(climayears), 365))
-
-        if fdoy < s1s:
-            if s1s <= (s1s + w_leadtime):
-                metric = np.sum(outmat[:, s1s:s1s + w_leadtime], axis=1)  # weighted by JJA forecast
-            else:
-                metric1 = np.sum(outmat[:, s1s:], axis=1)
-                metric2 = np.sum(outmat[:, :((s1s + w_leadtime) - 365)], axis=1)
-                metric = metric1 + metric2   
-           
-        elif (fdoy >= s1s) and (fdoy < s2s):
-            if s2s <= (s2s + w_leadtime):
-                metric = np.sum(outmat[:, s2s:s2s + w_leadtime], axis=1)  # weighted by JAS forecast
-            else:
-                metric1 = np.sum(outmat[:, s2s:], axis=1)
-                metric2 = np.sum(outmat[:, :((s2s + w_leadtime) - 365)], axis=1)
-                metric = metric1 + metric2     # weighted by JAS forecast
-           
-        elif (fdoy >= s2s) and (fdoy < s3s):
-            if s3s <= (s3s + w_leadtime):
-                metric = np.sum(outmat[:, s3s:s3s + w_leadtime], axis=1)  # weighted by ASO forecast
-            else:
-                metric1 = np.sum(outmat[:, s3s:], axis=1)
-                metric2 = np.sum(outmat[:, :((s3s + w_leadtime) - 365)], axis=1)
-                metric = metric1 + metric2   
-           
-        elif (fdoy >= s3s) and (fdoy < s4s):
-            if s4s <= (s4s + w_leadtime):
-                metric = np.sum(outmat[:, s4s:s4s + w_leadtime], axis=1)  # weighted by JJA forecast
-            else:
-                metric1 = np.sum(outmat[:, s4s:], axis=1)
-                metric2 = np.sum(outmat[:, :((s4s + w_leadtime) - 365)], axis=1)
-                metric = metric1 + metric2   
-           
-        else:
-            if s4s <= (s4s + w_leadtime):
-                metric = np.sum(outmat[:, s4s:s4s + w_leadtime], axis=1)  # weighted by JJA forecast
-            else:
-                metric1 = np.sum(outmat[:, s4s:], axis=1)
-                metric2 = np.sum(outmat[:, :((s4s + w_leadtime) - 365)], axis=1)
-                metric = metric1 + metric2   
+    # the season following the forecast date (the last one if the date is after all of them)
+    following = np.nonzero(fdoy < svals[:3])[0]
+    # (the day of year of the season start is used as the index of the first day)
+    start = svals[following[0] if len(following) else 3]
 
+    if weight_var == 0:
+        # total rainfall of the season
+        metric = window_metric(climatology_sums(wth_path, sta_name, climayears, weight_var), start, w_leadtime)
     elif weight_var == 1:
-        # read the file containing the climatological weather data
-        daily_tmin = []
-        daily_tmax = []
-        for i in range(0, len(climayears)):
-            climatmin = np.genfromtxt(wth_path + sta_name + '001001' + str(climayears[i])+'.wth', skip_header=4)[:, 3]
-            climatmax = np.genfromtxt(wth_path + sta_name + '001001' + str(climayears[i])+'.wth', skip_header=4)[:, 2]
-            daily_tmin = np.append(daily_tmin, climatmin)
-            daily_tmax = np.append(daily_tmax, climatmax)
-        # mean temperature
-        daily_tmean = (daily_tmin + daily_tmax) / 2.0
-
-        # Precipitation value of the climatological periods
-        outmat = np.reshape(daily_tmean, (len(climayears), 365))
-
-        if fdoy < s1s:
-            if s1s <= (s1s + w_leadtime):
-                metric = np.mean(outmat[:, s1s:s1s + w_leadtime], axis=1)  # weighted by JJA forecast
-            else:
-                metric1 = np.mean(outmat[:, s1s:], axis=1)
-                metric2 = np.mean(outmat[:, :((s1s + w_leadtime) - 365)], axis=1)
-                metric = (metric1 + metric2) / 2.
-         
-        elif (fdoy >= s1s) and (fdoy < s2s):
-            if s2s <= (s2s + w_leadtime):
-                metric = np.mean(outmat[:, s2s:s2s + w_leadtime], axis=1)  # weighted by JAS forecast
-            else:
-                metric1 = np.mean(outmat[:, s2s:], axis=1)
-                metric2 = np.mean(outmat[:, :((s2s + w_leadtime) - 365)], axis=1)
-                metric = (metric1 + metric2) / 2.     # weighted by JAS forecast
-          
-        elif (fdoy >= s2s) and (fdoy < s3s):
-            if s3s <= (s3s + w_leadtime):
-                metric = np.mean(outmat[:, s3s:s3s + w_leadtime], axis=1)  # weighted by ASO forecast
-            else:
-                metric1 = np.mean(outmat[:, s3s:], axis=1)
-                metric2 = np.mean(outmat[:, :((s3s + w_leadtime) - 365)], axis=1)
-                metric = (metric1 + metric2) / 2.   
-          
-        elif (fdoy >= s3s) and (fdoy < s4s):
-            if s4s <= (s4s + w_leadtime):
-                metric = np.mean(outmat[:, s4s:s4s + w_leadtime], axis=1)  # weighted by JJA forecast
-            else:
-                metric1 = np.mean(outmat[:, s4s:], axis=1)
-                metric2 = np.mean(outmat[:, :((s4s + w_leadtime) - 365)], axis=1)
-                metric = (metric1 + metric2) / 2.   
-          
-        else:
-            if s4s <= (s4s + w_leadtime):
-                metric = np.mean(outmat[:, s4s:s4s + w_leadtime], axis=1)  # weighted by JJA forecast
-            else:
-                metric1 = np.mean(outmat[:, s4s:], axis=1)
-                metric2 = np.mean(outmat[:, :((s4s + w_leadtime) - 365)], axis=1)
-                metric = (metric1 + metric2) / 2.   
-       
+        # mean temperature of the season
+        metric = window_metric(climatology_sums(wth_path, sta_name, climayears, weight_var), start, w_leadtime,
+                               mean=True)
     else:
         raise ValueError('Weighting can be don by rain(0) or temperature(1). Please put 0 or 1 only!')
+    if np.any(np.isnan(metric)):
+        raise ValueError('The weighting season of %s runs past the end of the weather data (the weather '
+                         'file of %s is missing or incomplete).' % (climayears[-1], climayears[-1] + 1))
 
     # save the metric in a text file
+    if weightfile is None:
+        return metric
     weightmetric_ts = np.array([climayears, metric])
     weightmetric_ts = weightmetric_ts.T
     np.savetxt(weightfile, weightmetric_ts, delimiter=' ', header='ClimaYears    WeightMetricValue', fmt='%i    %6.2f')
+    return metric
+
+
+def season_starts(wf_year, wf_day):
+    """
+    This function return the season starting dates of the 12 months: the day of
+    year of the day wf_day of every month. When the day does not exist in a month
+    (e.g. 31st) the last day of the month (of a non leap year) is used.
+    :param wf_year: the year value for the forecast (this value is a dummy value to count dates)
+    :param wf_day: the first day for the season for which weighting is considered
+    :return the day of year of the season start of each month
+    """
+    months = np.arange('%04d-01' % wf_year, '%04d-01' % (wf_year + 1), dtype='datetime64[M]')
+    doy = (months.astype('datetime64[D]') - np.datetime64('%04d-01-01' % wf_year)).astype(int) + wf_day
+    return np.where(wf_day > MONTH_DAYS, MONTH_END_DOY, doy)
+
+
+def window_sums(daily, following=None):
+    """
+    This function calculate the cumulative sums of the daily values of the consecutive
+    years followed by the year after the last one, so the sum over any window of up to
+    one year, including the windows running past the end of the year into the next
+    year, is the difference of two values (see window_metric).
+    :param daily: the daily values of consecutive years (year x day)
+    :param following: the daily values of the year after the last one (can be shorter
+                      than a year or None, the windows needing the missing days are NaN)
+    :return the cumulative sums of each year and the next one (year x 2 * day + 1), starting
+            with 0. They are read-only views of the cumulative sums of the whole series.
+    """
+    daily = np.asarray(daily, dtype=float)
+    nyears, ndays = daily.shape
+    series = np.full((nyears + 1) * ndays, np.nan)
+    series[:nyears * ndays] = daily.ravel()
+    if following is not None:
+        following = np.asarray(following, dtype=float)[:ndays]
+        series[nyears * ndays:nyears * ndays + len(following)] = following
+    sums = np.zeros(len(series) + 1)
+    np.cumsum(series, out=sums[1:])
+    return np.lib.stride_tricks.as_strided(sums, shape=(nyears, 2 * ndays + 1),
+                                           strides=(ndays * sums.strides[0], sums.strides[0]), writeable=False)
+
+
+def window_metric(sums, start, leadtime, mean=False):
+    """
+    This function return the sum (or the mean) of the daily values over windows
+    of leadtime days from the day index start, for every year.
+    :param sums: the cumulative sums of the daily values (see window_sums)
+    :param start: the index of the first day of the window (scalar or array)
+    :param leadtime: the number of days of the window, up to one year (scalar or array)
+    :param mean: if True the mean over the window is returned instead of the sum
+    :return the metric (year x shape of start and leadtime broadcast together)
+    """
+    ndays = (sums.shape[-1] - 1) // 2
+    start = np.asarray(start) % ndays
+    leadtime = np.asarray(leadtime)
+    total = sums[..., start + leadtime] - sums[..., start]
+    if mean:
+        return total / leadtime
+    return total
+
+
+def window_table(daily, mean=False, following=None):
+    """
+    This function return the sum (or the mean) of the daily values for every
+    start day and every lead time (1 to one year) in one pass.
+    :param daily: the daily values of consecutive years (year x day)
+    :param mean: if True the mean over the windows is returned instead of the sum
+    :param following: the daily values of the year after the last one (see window_sums)
+    :return the metric (year x start day index x lead time - 1)
+    """
+    ndays = np.shape(daily)[-1]
+    return window_metric(window_sums(daily, following), np.arange(ndays)[:, None],
+                         np.arange(1, ndays + 1)[None, :], mean)
+
+
+def daily_variable(weather, weight_var):
+    """
+    This function return the daily rainfall (weight_var 0) or mean temperature
+    (weight_var 1) of the weather data (... x day x [date, srad, tmax, tmin, rain]).
+    """
+    if weight_var == 0:
+        # Precipitation value of the climatological periods
+        return weather[..., 4]
+    # mean temperature of the climatological periods
+    return (weather[..., 3] + weather[..., 2]) / 2.0
+
+
+def climatology_sums(wth_path, sta_name, climayears, weight_var):
+    """
+    This function return the cumulative sums (see window_sums) of the daily rainfall
+    (weight_var 0) or mean temperature (weight_var 1) of the climatological years and
+    of the year after them (the observed weather copy origi_ of the forecast year is
+    used when there is one). They are calculated once for the climatology data of the
+    in-process cache (wthfile.load_climatology) and dropped with it.
+    """
+    # the climatological weather data (shared in-process cache)
+    climadata = load_climatology(wth_path, sta_name, climayears)
+    nextyear = int(climayears[-1]) + 1
+    nextdata = None
+    for name in ('origi_' + sta_name, sta_name):
+        if os.path.isfile(wth_filename(wth_path, name, nextyear)):
+            nextdata = load_climatology(wth_path, name, [nextyear])
+            break
+
+    # keep only the sums of the weather still in the climatology cache
+    live = [entry[1] for entry in clima_cache.values()]
+    for key in list(_window_sums.keys()):
+        cubes = [cube for cube in _window_sums[key][:2] if cube is not None]
+        if not all(any(cube is weather for weather in live) for cube in cubes):
+            del _window_sums[key]
+
+    key = (wth_path, sta_name, tuple(int(year) for year in climayears), weight_var)
+    cached = _window_sums.get(key)
+    if cached is not None and cached[0] is climadata and cached[1] is nextdata:
+        return cached[2]
+    following = None if nextdata is None else daily_variable(nextdata[0], weight_var)
+    sums = window_sums(daily_variable(climadata, weight_var), following)
+    _window_sums[key] = (climadata, nextdata, sums)
+    return sums
@@ -0,0 +1,148 @@
+# =============================================================#
+# GLAM weather (.wth) file format
+# ============================================================#
+# This module is used to write and read the GLAM daily weather
+# files. The files have four header lines followed by fixed
+# width rows of date (yyddd), SRAD, TMAX, TMIN and RAIN:
+#   %05d%6.2f%6.2f%6.2f%6.2f
+# The header is written exactly as GLAM (FORTRAN) reads it so
+# the files do not need any further editing before a GLAM run.
+# The climatology years of a station are kept in an in-process
+# cache (load_climatology) shared by all the stages of a run.
+# ==============================================================#
+import numpy as np
+import os
+from collections import OrderedDict
+
+ROW_FORMAT = '%05d%6.2f%6.2f%6.2f%6.2f\n'
+ROW_WIDTH = 29
+COLUMNS = ((0, 5), (5, 11), (11, 17), (17, 23), (23, 29))
+HEADER_LINES = 4
+
+# upper bound (bytes) of the climatology weather cubes kept in memory,
+# the least recently used cubes are dropped first when it is exceeded
+clima_cache_max_bytes = 64 * 1024 * 1024
+clima_cache = OrderedDict()
+
+
+def wth_filename(wth_path, sta_name, year):
+    """
+    This function return the GLAM name of the weather file of a year
+    for the station (<wth_path><sta_name>001001<year>.wth).
+    """
+    return wth_path + sta_name + '001001' + str(year) + '.wth'
+
+
+def wth_header(lat, lon):
+    """
+    This function return the header of the GLAM weather file.
+    :param lat: the latitude of the location in degrees
+    :param lon: the longitude of the location in degrees
+    """
+    return '*WEATHER : Example weather file\n' \
+           '@INS   LAT  LONG  ELEV   TAV   AMP REFHT WNDHT\n' \
+           'ITHY %s  %s\n' \
+           '@DATE   SRAD   TMAX   TMIN   RAIN \n' % (lat, lon)
+
+
+def format_wth(weather, lat, lon):
+    """
+    This function return the content of the GLAM weather file as a string.
+    :param weather: the weather data (day x [date, srad, tmax, tmin, rain])
+    :param lat: the latitude of the location in degrees
+    :param lon: the longitude of the location in degrees
+    """
+    weather = np.asarray(weather, dtype=float)
+    return wth_header(lat, lon) + (ROW_FORMAT * len(weather)) % tuple(weather.ravel())
+
+
+def write_wth(filename, weather, lat, lon):
+    """
+    This function write the GLAM weather file in a single buffered write.
+    :param filename: the name of the .wth file
+    :param weather: the weather data (day x [date, srad, tmax, tmin, rain])
+    :param lat: the latitude of the location in degrees
+    :param lon: the longitude of the location in degrees
+    :return None
+    """
+    with open(filename, 'w') as f:
+        f.write(format_wth(weather, lat, lon))
+    return None
+
+
+def read_wth(filename):
+    """
+    This function read a single GLAM weather file.
+    :param filename: the name of the .wth file
+    :return the weather data (day x [date, srad, tmax, tmin, rain])
+    """
+    return read_wth_files([filename])[0]
+
+
+def read_wth_files(filenames):
+    """
+    This function read many GLAM weather files of the same length into
+    one array. The fixed width rows of all the files are parsed together.
+    The header lines are skipped whether they are commented ('#') or not.
+    :param filenames: list of the .wth file names
+    :return the weather data (file x day x [date, srad, tmax, tmin, rain])
+    """
+    lines = []
+    ndays = None
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            rows = [row for row in f.read().splitlines()[HEADER_LINES:] if row.strip()]
+        if ndays is None:
+            ndays = len(rows)
+        elif len(rows) != ndays:
+            raise ValueError('The weather file %s has %s days, %s days expected.' % (filename, len(rows), ndays))
+        lines.extend(rows)
+
+    # slice the fixed width columns of all the rows at once
+    chars = np.array(lines, dtype='S%d' % ROW_WIDTH).view('S1').reshape(len(lines), ROW_WIDTH)
+    weather = np.empty((len(lines), len(COLUMNS)))
+    for j in range(0, len(COLUMNS)):
+        start, end = COLUMNS[j]
+        weather[:, j] = chars[:, start:end].copy().view('S%d' % (end - start)).ravel().astype(float)
+    return np.reshape(weather, (len(filenames), ndays, len(COLUMNS)))
+
+
+def load_climatology(wth_path, sta_name, climayears):
+    """
+    This function return the weather data of the climatological years of a
+    station. The files are read once and the array is kept in memory for the
+    next calls. A cached array is reused only while the size and the
+    modification time of all its files are unchanged.
+    :param wth_path: the path of the wth file (where the weather data is.)
+    :param sta_name: the name of the station or point.
+    :param climayears: the climatological years array
+    :return the read-only weather data (year x day x [date, srad, tmax, tmin, rain])
+    """
+    filenames = [wth_filename(wth_path, sta_name, year) for year in climayears]
+    key = (wth_path, sta_name, tuple(filenames))
+    stamp = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamp.append((stat.st_size, stat.st_mtime))
+
+    if key in clima_cache and clima_cache[key][0] == stamp:
+        weather = clima_cache.pop(key)[1]
+    else:
+        clima_cache.pop(key, None)
+        weather = read_wth_files(filenames)
+        weather.flags.writeable = False
+    clima_cache[key] = (stamp, weather)
+
+    # drop the least recently used cubes above the size bound
+    while len(clima_cache) > 1 and \
+            sum(entry[1].nbytes for entry in clima_cache.values()) > clima_cache_max_bytes:
+        clima_cache.popitem(last=False)
+    return weather
+
+
+def clear_climatology_cache():
+    """
+    This function empty the in-process climatology cache.
+    """
+    clima_cache.clear()
+    return None